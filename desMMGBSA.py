@@ -1,12 +1,23 @@
+import argparse
+import functools
 import os
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from desbatch import add_batch_arguments, add_parallel_arguments, batch_files, is_batch, make_parent_dir
+from descompress import has_suffix, open_input
+from desparallel import map_files
+from desprofile import configure, phase, timed
+from desstats import StreamingStats
 
+CHUNK_ROWS = 100000
+RANK_COLUMN = 'r_psp_MMGBSA_dG_Bind'
+
+@timed('list_files')
 def load_csv_files():
     """
     Function to load all CSV files in the current directory.
     """
-    csv_files = [file for file in os.listdir() if file.endswith('.csv')]
+    csv_files = [file for file in os.listdir() if has_suffix(file, '.csv')]
     return csv_files
 
 def choose_csv_file(csv_files):
@@ -31,12 +42,12 @@ def filter_columns(data):
     """
     return data.select_dtypes(exclude=['object'])
 
+@timed('statistics')
 def generate_statistics(data):
     """
     Function to generate statistics from a given CSV file.
     """
     statistics = data.describe().transpose()
-    statistics['median'] = data.median()
     statistics = statistics[['mean', '50%', 'std', 'min', 'max']]
     statistics.columns = ['average', 'median', 'standard deviation', 'min_value', 'max_value']
     return statistics
@@ -53,28 +64,206 @@ def filter_nan_rows(statistics):
     """
     return statistics.dropna()
 
-def save_statistics_to_file(statistics, csv_file, compound_name):
+def save_statistics_to_file(statistics, csv_file, compound_name, output_path='output.txt', mode='w'):
     """
     Function to save statistics to a text file.
     """
-    with open('output.txt', 'w') as f:
+    with open(output_path, mode) as f:
         f.write(f'Statistics for {csv_file}:\n')
         f.write(f'Compound Name: {compound_name}\n')
         f.write(statistics.to_string())
+        f.write('\n\n' if mode == 'a' else '')
+
+def analyze_csv_file(csv_file):
+    """
+    Function to compute the filtered statistics of one CSV file.
+    """
+    with phase('parse'), open_input(csv_file) as file:
+        data = pd.read_csv(file)
+    compound_name = get_compound_name(data)
+    data = filter_columns(data.drop(columns=['title']))
+    statistics = generate_statistics(data)
+    statistics_filtered = filter_zero_rows(statistics)
+    statistics_filtered = filter_nan_rows(statistics_filtered)
+    return statistics_filtered, compound_name
+
+def _chunk_moments(titles, values):
+    """
+    Function to reduce one chunk to per-title count, sum, sum of squares, min,
+    max and median of every column, with one vectorized groupby.
+    """
+    groups = values.groupby(titles, sort=False)
+    return pd.concat({'count': groups.count(), 'sum': groups.sum(), 'squares': (values ** 2).groupby(titles, sort=False).sum(),
+                      'min': groups.min(), 'max': groups.max(), 'median': groups.median()}, axis=1)
+
+def _run_starts(titles):
+    """
+    Function to find where each run of equal titles starts in a chunk.
+    """
+    return np.concatenate([[0], np.flatnonzero(titles[1:] != titles[:-1]) + 1])
+
+@timed('summarize_csv_file')
+def summarize_csv_file(csv_file, chunksize=CHUNK_ROWS):
+    """
+    Function to compute statistics per compound ('title') of a CSV file read in
+    chunks. Each chunk is reduced per title with one groupby and the partial
+    results are merged. A title within one chunk takes the chunk's exact
+    median; a run of rows continuing across chunks feeds a t-digest; the rare
+    title split into separate runs is read again on its own for its median.
+    """
+    name = os.path.basename(csv_file)
+    pieces, digests, runs = [], {}, {}
+    columns, has_title, previous = None, False, None
+    with open_input(csv_file) as file, pd.read_csv(file, chunksize=chunksize) as reader:
+        for chunk in reader:
+            if columns is None:  # The header and the first chunk's types are read once
+                has_title = 'title' in chunk.columns
+                columns = [column for column in filter_columns(chunk).columns if column != 'title']
+            titles = chunk['title'].to_numpy() if has_title else np.full(len(chunk), name, dtype=object)
+            values = chunk[columns].astype('float64')
+            pieces.append(_chunk_moments(titles, values))
+
+            starts = _run_starts(titles)
+            continued = titles[0] == previous
+            for title in titles[starts[1:] if continued else starts]:
+                runs[title] = runs.get(title, 0) + 1
+            if continued:  # Rows continuing the previous chunk's last run
+                stop = starts[1] if len(starts) > 1 else len(titles)
+                for column, digest in zip(columns, digests[titles[0]]):
+                    column_values = values[column].to_numpy()[:stop]
+                    digest.update(column_values[~np.isnan(column_values)])
+            if not continued or len(starts) > 1:  # The last run may continue in the next chunk
+                digests[titles[-1]] = [StreamingStats() for _ in columns]
+                for column, digest in zip(columns, digests[titles[-1]]):
+                    column_values = values[column].to_numpy()[starts[-1]:]
+                    digest.update(column_values[~np.isnan(column_values)])
+            previous = titles[-1]
+    if not pieces:
+        return None
+
+    table = pd.concat(pieces)
+    by_title = lambda statistic: table[statistic].groupby(level=0, sort=False)
+    count, total, squares = by_title('count').sum(), by_title('sum').sum(), by_title('squares').sum()
+    minimum, maximum, median = by_title('min').min(), by_title('max').max(), by_title('median').first()
+    split = [title for title, number in table.index.value_counts().items() if number > 1]
+    rerun = [title for title in split if runs[title] > 1]
+    for title in split:
+        if runs[title] == 1:
+            median.loc[title] = [digest.quantile(0.5) for digest in digests[title]]
+    if rerun:
+        with open_input(csv_file) as file, pd.read_csv(file, usecols=['title'] + columns, chunksize=chunksize) as reader:
+            rows = pd.concat([chunk[chunk['title'].isin(rerun)] for chunk in reader])
+        median.loc[rerun] = rows.groupby('title')[columns].median().astype('float64').loc[rerun].to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        deviation = np.sqrt(np.clip((squares - total * mean) / (count - 1), 0, None))
+
+    def flat(frame):
+        return frame[columns].to_numpy(dtype=np.float64).ravel()
+    statistics = pd.DataFrame({
+        'file': csv_file,
+        'title': np.repeat(count.index.to_numpy(), len(columns)),
+        'column': np.tile(columns, len(count)),
+        'count': count[columns].to_numpy().ravel(),
+        'average': flat(mean),
+        'median': flat(median),
+        'standard deviation': flat(deviation),
+        'min_value': flat(minimum),
+        'max_value': flat(maximum),
+    })
+    values = statistics[['average', 'median', 'standard deviation', 'min_value', 'max_value']]
+    return statistics[(values.fillna(0) != 0).any(axis=1) & statistics['average'].notna()]
+
+def rank_statistics(statistics, rank_by=RANK_COLUMN):
+    """
+    Function to rank the compounds of a combined table by the average of one
+    column (lowest first) and sort the table by that rank.
+    """
+    scores = statistics[statistics['column'] == rank_by].set_index(['file', 'title'])['average']
+    ranks = scores.rank(method='min').rename('rank')
+    statistics = statistics.join(ranks, on=['file', 'title'])
+    return statistics.sort_values(['rank', 'file', 'title', 'column'], na_position='last').reset_index(drop=True)
+
+def save_combined_table(statistics, output_path):
+    """
+    Function to save the combined table as Parquet (.parquet) or CSV.
+    """
+    make_parent_dir(output_path)
+    if output_path.endswith('.parquet'):
+        try:
+            statistics.to_parquet(output_path, index=False)
+        except ImportError:
+            print("Parquet output needs pyarrow or fastparquet. Writing CSV instead.")
+            output_path = os.path.splitext(output_path)[0] + '.csv'
+            statistics.to_csv(output_path, index=False, float_format='%.7g')
+    else:
+        statistics.to_csv(output_path, index=False, float_format='%.7g')  # float32 inputs carry ~7 digits
+    print(f"Combined statistics saved to {output_path}")
+
+def run_combined(args, csv_files):
+    """
+    Function to summarize many CSV files in parallel into one ranked table.
+    """
+    summarize = functools.partial(summarize_csv_file, chunksize=args.chunk_rows)
+    tables = [table for table in map_files(summarize, csv_files, args.workers, args.chunksize) if table is not None]
+    if not tables:
+        print("No statistics could be computed.")
+        return
+    save_combined_table(rank_statistics(pd.concat(tables, ignore_index=True), args.rank_by), args.combined)
+
+def parse_arguments(argv=None):
+    """
+    Function to parse the command line options of the batch mode.
+    """
+    parser = argparse.ArgumentParser(description="Summarize Prime MM-GBSA CSV files. Without batch options, the file is chosen interactively.")
+    group = add_batch_arguments(parser, names=False, kind='mmgbsa')
+    group.add_argument('--output', default='output.txt', metavar='PATH',
+                       help="Text file the statistics of every input are written to (default: output.txt).")
+    group.add_argument('--combined', metavar='PATH',
+                       help="Instead, read every input in chunks and write one table ranked by compound (.csv or .parquet).")
+    group.add_argument('--rank-by', default=RANK_COLUMN, metavar='COLUMN',
+                       help=f"Column whose average ranks the compounds in the combined table (default: {RANK_COLUMN}).")
+    group.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, metavar='N',
+                       help=f"Rows read at a time in the combined mode (default: {CHUNK_ROWS}).")
+    add_parallel_arguments(group)
+    return parser.parse_args(argv)
+
+def run_batch(args):
+    """
+    Function to write the statistics of every selected CSV file to one text file.
+    """
+    csv_files = batch_files(args)
+    if not csv_files:
+        print("No CSV files matched.")
+        return
+    if args.combined:
+        run_combined(args, csv_files)
+        return
+    make_parent_dir(args.output)
+    open(args.output, 'w').close()
+    for csv_file in csv_files:
+        try:
+            statistics, compound_name = analyze_csv_file(csv_file)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"Failed to analyze {csv_file}: {e}. Skipping...")
+            continue
+        save_statistics_to_file(statistics, csv_file, compound_name, args.output, mode='a')
+    print(f"Statistics saved to {args.output}")
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if is_batch(args):
+        run_batch(args)
+        return
 
-def main():
     csv_files = load_csv_files()
     if not csv_files:
         print("No CSV files found in the current directory.")
         return
     
     csv_file = choose_csv_file(csv_files)
-    data = pd.read_csv(csv_file)
-    compound_name = get_compound_name(data)
-    data = filter_columns(data.drop(columns=['title']))
-    statistics = generate_statistics(data)
-    statistics_filtered = filter_zero_rows(statistics)
-    statistics_filtered = filter_nan_rows(statistics_filtered)  
+    statistics_filtered, compound_name = analyze_csv_file(csv_file)
     save_statistics_to_file(statistics_filtered, csv_file, compound_name)
     print("\nThank you byebye!\n")
 
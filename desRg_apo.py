@@ -1,12 +1,21 @@
-import matplotlib.pyplot as plt
-import numpy as np
+import argparse
 import glob
 import os
-import pandas as pd
+from desbatch import (add_batch_arguments, add_downsample_argument, add_figure_arguments, batch_entries, finish_figure, is_batch,
+                      use_headless_backend)
+from desprofile import configure, timed
+from descompress import has_suffix, open_input, strip_compression
+from desstore import convert_units, ingest_csv_files, query, resample
+from deswatch import CsvTail, run as watch_run
+from desdensity import ENVELOPES, plot_density
+from desdownsample import plot_line
 
+@timed('parse')
 def extract_rg_values(file_path):
+    import pandas as pd
     try:
-        df = pd.read_csv(file_path)
+        with open_input(file_path) as file:
+            df = pd.read_csv(file)
         time_values = df['Time (ns)'].values
         rg_column = [col for col in df.columns if 'Radius of Gyration' in col][0]
         rg_values = df[rg_column].values
@@ -15,31 +24,138 @@ def extract_rg_values(file_path):
         print(f"Error reading {file_path}: {e}")
         return None, None
 
+@timed('list_files')
 def get_all_csv_files():
-    return glob.glob('*.csv')
+    return [file for file in glob.glob('*.csv*') if has_suffix(file, '.csv')]
 
 def get_curve_name(file_path):
-    return os.path.basename(file_path).replace('.csv', '')
+    return os.path.basename(strip_compression(file_path)).replace('.csv', '')
 
-def plot_rg_time(selected_files, curve_names, unit_conversion):
-    colors = plt.cm.get_cmap('tab10', len(selected_files))
+@timed('render')
+def plot_rg_time(selected_files, curve_names, unit_conversion, output=None, formats=("png",), ax=None, series=None,
+                 downsample='minmax'):
+    """
+    Plot Rg over time for every file. Pass ax to draw into a panel of a larger
+    figure, and series to reuse (time, Rg) pairs already read. Long series are
+    downsampled to the width of the axes (see desdownsample).
+    """
+    import matplotlib.pyplot as plt
+    axes = ax if ax is not None else plt.gca()
+    colors = plt.get_cmap('tab10', len(selected_files))
 
     for i, file in enumerate(selected_files):
-        time_values, rg_values = extract_rg_values(file)
+        time_values, rg_values = series[i] if series is not None else extract_rg_values(file)
         if time_values is None or rg_values is None:
             print(f"Could not extract data from {file}")
             continue
 
-        rg_values = [value / unit_conversion for value in rg_values]  # Apply unit conversion to Y-axis
-        plt.plot(time_values, rg_values, label=curve_names[i], color=colors(i))
+        rg_values = convert_units(rg_values, unit_conversion)  # Apply unit conversion to Y-axis
+        plot_line(axes, time_values, rg_values, downsample, label=curve_names[i], color=colors(i))
 
-    plt.xlabel('Time (ns)')
-    plt.ylabel(f'Radius of Gyration ({"Å" if unit_conversion == 1 else "nm"})')
-    plt.legend()
-    plt.title('Radius of Gyration over Time')
-    plt.show()
+    format_rg_plot(unit_conversion, output, formats, ax)
+
+@timed('render')
+def plot_rg_store(store_dir, unit_conversion, trajectories=None, t_start=None, t_end=None, step=None,
+                  output=None, formats=("png",), aggregate=False, envelopes=ENVELOPES, downsample='minmax'):
+    import matplotlib.pyplot as plt
+    # Only the requested trajectories and time window are read from the store
+    time_values, rg_matrix, curve_names = query(store_dir, 'Radius of Gyration', trajectories, t_start, t_end)
+    if step:
+        time_values, rg_matrix = resample(time_values, rg_matrix, step)
+    if aggregate:
+        plot_rg_density([(time_values, rg_values) for rg_values in rg_matrix], unit_conversion, envelopes, output, formats)
+        return
+    rg_matrix = convert_units(rg_matrix, unit_conversion)
+    colors = plt.get_cmap('tab10', len(curve_names))
+    for i, (rg_values, name) in enumerate(zip(rg_matrix, curve_names)):
+        plot_line(plt.gca(), time_values, rg_values, downsample, label=name, color=colors(i))
+
+    format_rg_plot(unit_conversion, output, formats)
+
+def plot_rg_density(series, unit_conversion, envelopes=ENVELOPES, output=None, formats=("png",), ax=None):
+    """
+    Draw many Rg curves, given as (time, Rg) pairs, as one density image with
+    percentile envelopes instead of one line each.
+    """
+    series = [(time_values, convert_units(rg_values, unit_conversion)) for time_values, rg_values in series
+              if time_values is not None]
+    plot_density(series, 'Time (ns)', f'Radius of Gyration ({"Å" if unit_conversion == 1 else "nm"})',
+                 'Radius of Gyration over Time', envelopes, ax=ax)
+    if ax is None:
+        finish_figure(output, formats)
+
+def format_rg_plot(unit_conversion, output=None, formats=("png",), ax=None):
+    import matplotlib.pyplot as plt
+    axes = ax if ax is not None else plt.gca()
+    axes.set_xlabel('Time (ns)')
+    axes.set_ylabel(f'Radius of Gyration ({"Å" if unit_conversion == 1 else "nm"})')
+    axes.legend()
+    axes.set_title('Radius of Gyration over Time')
+    if ax is None:
+        finish_figure(output, formats)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Plot the Radius of Gyration over time from CSV files. Without batch options, the files are chosen interactively.")
+    group = add_batch_arguments(parser, kind='rg')
+    group.add_argument('--unit', type=float, choices=[1, 10], default=1,
+                       help="Unit conversion factor for the Radius of Gyration, 1 for Å, 10 for nm (default: 1).")
+    group.add_argument('--store', metavar='DIR',
+                       help="Columnar store (see desstore.py) to plot from; with --files/--manifest the inputs are added to it first and plotted.")
+    group.add_argument('--trajectories', nargs='+', metavar='NAME',
+                       help="Trajectories of the store to plot (default: the files just added, or all).")
+    group.add_argument('--t-start', type=float, metavar='NS', help="Start of the time window, in ns.")
+    group.add_argument('--t-end', type=float, metavar='NS', help="End of the time window, in ns.")
+    group.add_argument('--watch', type=float, metavar='SECONDS',
+                       help="Keep following the inputs while they grow, refreshing the figure (and --summary) every SECONDS.")
+    group.add_argument('--summary', metavar='CSV', help="With --watch, CSV summary of every input rewritten after each update.")
+    group.add_argument('--aggregate', action='store_true',
+                       help="Draw all curves as one time-by-value density image, for overlays of many trajectories.")
+    group.add_argument('--envelopes', nargs='*', type=float, default=list(ENVELOPES), metavar='PERCENTILE',
+                       help="Percentile curves drawn over the density image (default: 5 50 95; none without values).")
+    group.add_argument('--resample', type=float, metavar='NS', help="Average the frames over windows of this length, in ns.")
+    add_downsample_argument(group)
+    add_figure_arguments(group, 'rg_time')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if args.store:
+        use_headless_backend()
+        trajectories = args.trajectories
+        if is_batch(args):
+            entries = batch_entries(args)
+            if not entries:
+                print("No CSV files matched.")
+                return
+            selected_files, curve_names = zip(*entries)
+            ingest_csv_files(selected_files, args.store, curve_names)
+            trajectories = trajectories or list(curve_names)  # The store may hold earlier trajectories too
+        plot_rg_store(args.store, args.unit, trajectories, args.t_start, args.t_end, args.resample,
+                      args.output, args.formats, args.aggregate, args.envelopes, args.downsample)
+        return
+    if args.watch and is_batch(args):
+        entries = batch_entries(args)
+        tails = [CsvTail(file, unit_conversion=args.unit) for file, _ in entries]
+        watch_run(tails, [name for _, name in entries], args.watch, args.output, args.formats, args.summary,
+                  x_label='Time (ns)', y_label=f'Radius of Gyration ({"Å" if args.unit == 1 else "nm"})',
+                  title='Radius of Gyration over Time', downsample=args.downsample)
+        return
+    if is_batch(args):
+        use_headless_backend()
+        entries = batch_entries(args)
+        if not entries:
+            print("No CSV files matched.")
+            return
+        selected_files, curve_names = zip(*entries)
+        if args.aggregate:
+            series = [extract_rg_values(file) for file in selected_files]
+            plot_rg_density(series, args.unit, args.envelopes, args.output, args.formats)
+            return
+        plot_rg_time(list(selected_files), list(curve_names), args.unit, args.output, args.formats,
+                     downsample=args.downsample)
+        return
 
-def main():
     unit_conversion = float(input("Enter the unit conversion factor for Radius of Gyration (1 for Å, 10 for nm): "))
 
     csv_files = get_all_csv_files()
@@ -0,0 +1,346 @@
+import argparse
+import csv
+import functools
+import re
+import sys
+
+import numpy as np
+
+from desbatch import add_batch_arguments, add_parallel_arguments, batch_entries, is_batch, make_parent_dir
+from deseaf import EafSyntaxError, contacts_block, load_block, load_blocks, sse_block, torsion_blocks
+from desparallel import map_files
+from desprofile import configure, timed
+
+HELIX_CODES = 'HGI'
+STRAND_CODES = 'EB'
+HELIX_VALUES = (1,)
+STRAND_VALUES = (2,)
+TORSION_BINS = 36
+FRAME_CHUNK = 1 << 16  # Frames converted at a time, a multiple of 8 so chunks pack into whole bytes
+
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+class BitMatrix:
+    """
+    Boolean (rows, frames) matrix, e.g. residues by frames, packed along the
+    frames with 8 frames per byte. Per-row counts come straight from the
+    packed bytes; per-frame counts unpack a chunk of frames at a time.
+    """
+
+    def __init__(self, packed, frames):
+        self.packed = packed
+        self.frames = frames
+
+    @classmethod
+    def from_pairs(cls, rows, frames, shape):
+        """
+        Matrix with True at every (rows[i], frames[i]) pair.
+        """
+        packed = np.zeros((shape[0], -(-shape[1] // 8)), dtype=np.uint8)
+        frames = np.asarray(frames, dtype=np.int64)
+        np.bitwise_or.at(packed, (np.asarray(rows, dtype=np.int64), frames >> 3),
+                         np.left_shift(1, frames & 7).astype(np.uint8))
+        return cls(packed, shape[1])
+
+    @staticmethod
+    def pack(dense):
+        """
+        Packed bytes of a dense (rows, frames) boolean block; blocks spanning a
+        multiple of 8 frames can be concatenated along the frames.
+        """
+        return np.packbits(dense, axis=1, bitorder='little')
+
+    @property
+    def shape(self):
+        return self.packed.shape[0], self.frames
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def __or__(self, other):
+        return BitMatrix(self.packed | other.packed, self.frames)
+
+    def dense(self, start=0, stop=None):
+        """
+        Unpacked boolean block of the frames [start, stop), start a multiple of 8.
+        """
+        stop = self.frames if stop is None else min(stop, self.frames)
+        return np.unpackbits(self.packed[:, start // 8:-(-stop // 8)], axis=1, count=stop - start,
+                             bitorder='little').astype(bool)
+
+    def row_counts(self):
+        return _POPCOUNT[self.packed].sum(axis=1, dtype=np.int64)
+
+    def frame_counts(self, chunk=FRAME_CHUNK):
+        return np.concatenate([self.dense(start, start + chunk).sum(axis=0) for start in range(0, self.frames, chunk)]
+                              or [np.empty(0, dtype=np.int64)])
+
+
+def residue_key(label):
+    """
+    Sort key of residue labels such as 'A:ASP_25': chain, then number.
+    """
+    match = re.match(r'(?:(\w*):)?.*?(-?\d+)\D*$', label)
+    if not match:
+        return label, 0
+    return match.group(1) or '', int(match.group(2))
+
+
+def _contacts(entries):
+    """
+    (frame, residue) of every contact of a *Result list, which holds one list
+    of contacts per frame or contacts carrying their own Frame field.
+    """
+    for position, item in enumerate(entries):
+        for contact in item if isinstance(item, list) else [item]:
+            if not isinstance(contact, dict):
+                continue
+            residue = contact.get('ProtResidue', contact.get('Residue'))
+            if residue is not None:
+                yield int(contact.get('Frame', position)), str(residue)
+
+
+def contact_matrices(fields, n_frames=None):
+    """
+    Turn a contacts block into residue labels and one residues x frames
+    BitMatrix per interaction type (HBond, Hydrophobic, ...). n_frames
+    defaults to the last frame with a contact or the number of frame lists.
+    """
+    records = {key[:-len('Result')]: list(_contacts(value)) for key, value in fields.items()
+               if key.endswith('Result') and isinstance(value, list)}
+    labels = sorted({residue for contacts in records.values() for _, residue in contacts}, key=residue_key)
+    lookup = {label: row for row, label in enumerate(labels)}
+    if n_frames is None:
+        n_frames = max([frame + 1 for contacts in records.values() for frame, _ in contacts]
+                       + [len(fields[f'{kind}Result']) for kind in records] + [0])
+    matrices = {}
+    for kind, contacts in records.items():
+        frames = np.fromiter((frame for frame, _ in contacts), np.int64, len(contacts))
+        rows = np.fromiter((lookup[residue] for _, residue in contacts), np.int64, len(contacts))
+        matrices[kind] = BitMatrix.from_pairs(rows, frames, (len(labels), n_frames))
+    return labels, matrices
+
+
+def contact_occupancy(labels, matrices):
+    """
+    Fraction of frames in which every residue makes each type of contact,
+    and any contact at all, as {'Residue': labels, type: fractions, ...}.
+    """
+    table = {'Residue': labels}
+    if not matrices:
+        return table
+    frames = max(next(iter(matrices.values())).frames, 1)
+    for kind, matrix in matrices.items():
+        table[kind] = matrix.row_counts() / frames
+    table['Any'] = functools.reduce(lambda a, b: a | b, matrices.values()).row_counts() / frames
+    return table
+
+
+def _sse_codes(frames):
+    """
+    (frames, residues) array of the secondary structure codes of a slice of
+    an SSE Result: per-frame strings (one letter per residue) or per-frame
+    numeric arrays.
+    """
+    if all(isinstance(frame, str) for frame in frames):
+        lengths = {len(frame) for frame in frames}
+        if len(lengths) > 1:
+            raise ValueError("SSE frames of different lengths")
+        return np.frombuffer(''.join(frames).encode('ascii', 'replace'), dtype=np.uint8).reshape(len(frames), -1)
+    return np.vstack([np.asarray(frame, dtype=np.float64) for frame in frames])
+
+
+def sse_matrices(fields, chunk=FRAME_CHUNK):
+    """
+    Turn an SSE block into residue labels and residues x frames helix and
+    strand BitMatrices. Letters H, G, I count as helix and E, B as strand;
+    numeric codes 1 as helix and 2 as strand. The frames are converted a chunk
+    at a time, so the dense codes are never held for the whole trajectory.
+    """
+    frames = fields.get('Result')
+    if isinstance(frames, np.ndarray) or not isinstance(frames, list) or not frames:
+        return None
+    helix_chunks, strand_chunks = [], []
+    for start in range(0, len(frames), chunk):
+        codes = _sse_codes(frames[start:start + chunk])
+        if codes.dtype == np.uint8:
+            helix = np.isin(codes, np.frombuffer(HELIX_CODES.encode(), dtype=np.uint8))
+            strand = np.isin(codes, np.frombuffer(STRAND_CODES.encode(), dtype=np.uint8))
+        else:
+            helix, strand = np.isin(codes, HELIX_VALUES), np.isin(codes, STRAND_VALUES)
+        helix_chunks.append(BitMatrix.pack(helix.T))
+        strand_chunks.append(BitMatrix.pack(strand.T))
+    residues = helix_chunks[0].shape[0]
+    labels = fields.get('ProteinResidues')
+    if not isinstance(labels, list) or len(labels) != residues:
+        labels = [str(number) for number in range(1, residues + 1)]
+    return (labels, BitMatrix(np.concatenate(helix_chunks, axis=1), len(frames)),
+            BitMatrix(np.concatenate(strand_chunks, axis=1), len(frames)))
+
+
+def sse_fractions(labels, helix, strand):
+    """
+    Per-residue helix and strand percentages over the trajectory, and the
+    per-frame helix and strand content (percent of residues).
+    """
+    frames, residues = max(helix.frames, 1), max(len(labels), 1)
+    per_residue = {'Residue': labels, 'Helix (%)': 100 * helix.row_counts() / frames,
+                   'Strand (%)': 100 * strand.row_counts() / frames}
+    per_frame = {'Helix (%)': 100 * helix.frame_counts() / residues, 'Strand (%)': 100 * strand.frame_counts() / residues}
+    return per_residue, per_frame
+
+
+def torsion_matrix(blocks):
+    """
+    Labels and a float32 (torsions, frames) matrix of dihedral angles, in
+    degrees, from torsion blocks whose Result holds one series or one series
+    per torsion. Shorter series are padded with NaN.
+    """
+    labels, series = [], []
+    for number, fields in enumerate(blocks, 1):
+        result = fields.get('Result')
+        rows = [result] if isinstance(result, np.ndarray) else [
+            row for row in result if isinstance(row, np.ndarray)] if isinstance(result, list) else []
+        label = fields.get('ASL') or fields.get('Name') or f'Torsion {number}'
+        for i, row in enumerate(rows, 1):
+            labels.append(label if len(rows) == 1 else f'{label} #{i}')
+            series.append(row)
+    if not series:
+        return None
+    matrix = np.full((len(series), max(len(row) for row in series)), np.nan, dtype=np.float32)
+    for row, values in zip(matrix, series):
+        row[:len(values)] = values
+    return labels, matrix
+
+
+@timed('statistics')
+def torsion_statistics(matrix, bins=TORSION_BINS):
+    """
+    Circular mean and standard deviation (degrees) of every torsion, and its
+    normalized histogram over bins equal sectors of [-180, 180), all computed
+    for the whole matrix at once.
+    """
+    valid = ~np.isnan(matrix)
+    radians = np.deg2rad(np.where(valid, matrix, 0))
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = np.where(valid, np.cos(radians), 0).sum(axis=1) / counts
+        sine = np.where(valid, np.sin(radians), 0).sum(axis=1) / counts
+        length = np.clip(np.hypot(cosine, sine), 1e-12, 1)
+        sector = (np.floor((np.mod(matrix[valid] + 180, 360)) / 360 * bins).astype(np.int64)) % bins
+        rows = np.nonzero(valid)[0]
+        histogram = np.bincount(rows * bins + sector, minlength=len(matrix) * bins).reshape(len(matrix), bins)
+        return {'mean': np.rad2deg(np.arctan2(sine, cosine)), 'sd': np.rad2deg(np.sqrt(-2 * np.log(length))),
+                'histogram': histogram / counts[:, None]}
+
+
+def extract_contacts(file_path, n_frames=None):
+    """
+    Read a file's contacts block and return (residue labels, {type: BitMatrix}), or None.
+    """
+    try:
+        fields = load_block(file_path, contacts_block)
+    except EafSyntaxError:
+        return None
+    return None if fields is None else contact_matrices(fields, n_frames)
+
+
+def extract_sse(file_path):
+    """
+    Read a file's SSE block and return (residue labels, helix, strand), or None.
+    """
+    try:
+        fields = load_block(file_path, sse_block)
+    except EafSyntaxError:
+        return None
+    return None if fields is None else sse_matrices(fields)
+
+
+def extract_torsions(file_path):
+    """
+    Read a file's torsion blocks and return (labels, angles matrix), or None.
+    """
+    try:
+        return torsion_matrix(load_blocks(file_path, torsion_blocks))
+    except EafSyntaxError:
+        return None
+
+
+def contacts_table(file_path):
+    extracted = extract_contacts(file_path)
+    return None if extracted is None else contact_occupancy(*extracted)
+
+
+def sse_table(file_path):
+    extracted = extract_sse(file_path)
+    return None if extracted is None else sse_fractions(*extracted)[0]
+
+
+def torsions_table(file_path, bins=TORSION_BINS):
+    extracted = extract_torsions(file_path)
+    if extracted is None:
+        return None
+    labels, matrix = extracted
+    statistics = torsion_statistics(matrix, bins)
+    table = {'Torsion': labels, 'Circular Mean (deg)': statistics['mean'], 'Circular SD (deg)': statistics['sd']}
+    for number, edge in enumerate(np.linspace(-180, 180, bins + 1)[:-1]):
+        table[f'[{edge:g}, {edge + 360 / bins:g})'] = statistics['histogram'][:, number]
+    return table
+
+
+TABLES = {'contacts': contacts_table, 'sse': sse_table, 'torsions': torsions_table}
+
+
+def write_tables(entries, tables, output=None):
+    """
+    Write one CSV row per residue or torsion of every input, prefixed with the
+    input's name, to output or to stdout.
+    """
+    if output:
+        make_parent_dir(output)
+    file = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        writer = csv.writer(file)
+        header = list(dict.fromkeys(column for table in tables if table is not None for column in table))
+        writer.writerow(['name'] + header)
+        for (_, name), table in zip(entries, tables):
+            if table is None:
+                continue
+            columns = [table.get(column, [''] * len(next(iter(table.values())))) for column in header]
+            for row in zip(*columns):
+                writer.writerow([name] + [f'{value:.6g}' if isinstance(value, float) else value for value in row])
+    finally:
+        if output:
+            file.close()
+            print(f"Table saved to {output}")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the contacts, secondary structure or ligand torsions stored in .eaf files.")
+    parser.add_argument('analysis', choices=list(TABLES),
+                        help="contacts: occupancy of every residue per interaction type; sse: helix and strand "
+                             "percentages per residue; torsions: circular statistics and histogram per torsion.")
+    group = add_batch_arguments(parser, kind='eaf')
+    group.add_argument('--output', metavar='CSV', help="Write the table to this file instead of printing it.")
+    add_parallel_arguments(group)
+    args = parser.parse_args(argv)
+    if not is_batch(args):
+        parser.error("--files, --manifest or --catalog is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    entries = batch_entries(args)
+    tables = map_files(TABLES[args.analysis], [file for file, _ in entries], args.workers, args.chunksize)
+    for (file, _), table in zip(entries, tables):
+        if table is None:
+            print(f"No {args.analysis} data in {file}. Skipping...", file=sys.stderr)
+    write_tables(entries, tables, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import csv
+import glob
+import os
+
+from descompress import strip_compression
+from desdownsample import METHODS as DOWNSAMPLE_METHODS
+from desprofile import add_profile_arguments, phase
+
+FIGURE_FORMATS = ['png', 'svg', 'pdf']
+STRUCTURE_TYPES = {'apo': 1, 'holo': 2}
+HOLO_OPTIONS = {'protein': 1, 'ligand': 2, 'backbone': 3}
+
+
+def add_batch_arguments(parser, names=True, kind=None):
+    """
+    Add the options that switch a script from the interactive prompts to the
+    non-interactive batch mode. kind restricts the files selected from a
+    catalog (see descatalog.py) to one kind.
+    """
+    add_profile_arguments(parser)
+    group = parser.add_argument_group('batch mode')
+    group.add_argument('--files', nargs='+', metavar='PATTERN',
+                       help="Input files or glob patterns (enables batch mode).")
+    group.add_argument('--catalog', metavar='DB',
+                       help="Select the inputs from a catalog built by descatalog.py scan (enables batch mode).")
+    group.add_argument('--query', nargs='+', default=[], metavar='KEY=VALUE',
+                       help="Filters of the catalog selection: structure=apo|holo, selection=backbone|ligand_protein|"
+                            "ligand_ligand|rmsf, block=NAME, column=TEXT, path=GLOB.")
+    parser.set_defaults(catalog_kind=kind)
+    if names:
+        group.add_argument('--manifest', metavar='CSV',
+                           help="CSV with 'file,name' rows giving the inputs and their names (enables batch mode).")
+        group.add_argument('--names', nargs='+', metavar='NAME',
+                           help="Names for the inputs, in the same order (defaults to the file names).")
+    return group
+
+
+def add_parallel_arguments(group):
+    group.add_argument('--workers', type=int, default=None, metavar='N',
+                       help="Number of worker processes used to read the inputs (default: one per CPU).")
+    group.add_argument('--chunksize', type=int, default=1, metavar='N',
+                       help="Number of inputs handed to a worker at a time (default: 1).")
+
+
+def add_figure_arguments(group, default_output):
+    group.add_argument('--output', default=default_output, metavar='PATH',
+                       help=f"Output path of the figure, without extension (default: {default_output}).")
+    group.add_argument('--format', nargs='+', choices=FIGURE_FORMATS, default=['png'], dest='formats',
+                       help="Figure formats to write (default: png).")
+
+
+def add_downsample_argument(group):
+    group.add_argument('--downsample', choices=DOWNSAMPLE_METHODS, default='minmax',
+                       help="Reduce long series to the figure's pixel width before drawing: min/max per bucket (keeps every peak), "
+                            "LTTB, or none (default: minmax).")
+
+
+def is_batch(args):
+    return bool(args.files or args.catalog or getattr(args, 'manifest', None))
+
+
+def expand_files(patterns):
+    """
+    Expand glob patterns in order, keeping plain paths as they are and dropping
+    duplicates.
+    """
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for file in matches:
+            if file not in files:
+                files.append(file)
+    return files
+
+
+def read_manifest(manifest_path):
+    """
+    Read (file, name) pairs from a CSV manifest. Relative file paths are taken
+    relative to the manifest; a 'file,name' header and '#' comments are skipped.
+    """
+    base_dir = os.path.dirname(manifest_path)
+    entries = []
+    with open(manifest_path, newline='') as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith('#') or row[0].strip().lower() == 'file':
+                continue
+            path = os.path.join(base_dir, row[0].strip())
+            name = row[1].strip() if len(row) > 1 and row[1].strip() else default_name(path)
+            entries.append((path, name))
+    return entries
+
+
+def batch_files(args):
+    """
+    Return the input files selected on the command line, from --files or from
+    a catalog query.
+    """
+    if not args.catalog:
+        return expand_files(args.files or [])
+    from descatalog import parse_filters, select_files
+    try:
+        filters = dict({'kind': args.catalog_kind}, **parse_filters(args.query))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    files = select_files(args.catalog, **filters)
+    if args.files:
+        files += [file for file in expand_files(args.files) if file not in files]
+    return files
+
+
+def default_name(file_path):
+    return os.path.splitext(os.path.basename(strip_compression(file_path)))[0]
+
+
+def batch_entries(args):
+    """
+    Return the (file, name) pairs selected on the command line.
+    """
+    if getattr(args, 'manifest', None):
+        return read_manifest(args.manifest)
+    files = batch_files(args)
+    names = getattr(args, 'names', None)
+    if names is None:
+        names = [default_name(file) for file in files]
+    elif len(names) != len(files):
+        raise SystemExit(f"{len(names)} names given for {len(files)} files.")
+    return list(zip(files, names))
+
+
+def use_headless_backend():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def make_parent_dir(file_path):
+    """
+    Create the directory an output file goes to, if it does not exist yet.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def finish_figure(output=None, formats=('png',)):
+    """
+    Save the current figure to output.<format> for each format and close it, or
+    show it when no output is given.
+    """
+    import matplotlib.pyplot as plt
+    if output is None:
+        plt.show()
+        return
+    make_parent_dir(output)
+    with phase('save_figure'):
+        for fmt in formats:
+            plt.savefig(f"{output}.{fmt}", format=fmt, bbox_inches='tight')
+            print(f"Figure saved as {output}.{fmt}")
+        plt.close()
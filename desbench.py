@@ -0,0 +1,175 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import dessynth
+
+STAGES = ['extract_rmsd_values', 'extract_rmsf_values', 'extract_residue_numbers', 'extract_rg_values',
+          'calculate_metrics', 'kde', 'generate_statistics']
+
+
+def _reset_peak_rss():
+    """
+    Reset the kernel's peak RSS of this process (Linux), so the peak measured
+    afterwards excludes the stage's preparation. Returns False if unsupported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb(reset):
+    if reset:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_kb / 1024 if sys.platform != 'darwin' else peak_kb / 1024 ** 2
+
+
+def _run_stage(stage, files, repeat):
+    """
+    Run one stage in the current (fresh) process and return (seconds per run,
+    peak RSS in MB). Inputs of the stages that do not parse are prepared
+    before the clock starts, and the peak RSS covers the timed runs only
+    where the platform can reset it.
+    """
+    os.environ['DESMOTOOLS_NO_CACHE'] = '1'  # Always measure the parser, not the cache
+    import desprobaplot
+    import desrmsf
+
+    eaf_file, rg_file, mmgbsa_file = files
+    if stage == 'extract_rmsd_values':
+        run = lambda: desprobaplot.extract_rmsd_values(eaf_file, 1)
+    elif stage == 'extract_rmsf_values':
+        run = lambda: desrmsf.extract_rmsf_values(eaf_file)
+    elif stage == 'extract_residue_numbers':
+        run = lambda: desrmsf.extract_residue_numbers(eaf_file)
+    elif stage == 'extract_rg_values':
+        import desRg_apo
+        run = lambda: desRg_apo.extract_rg_values(rg_file)
+        run()  # Warm-up: the first call also imports pandas
+    elif stage == 'calculate_metrics':
+        values = desprobaplot.extract_rmsd_values(eaf_file, 1)
+        run = lambda: desprobaplot.calculate_metrics(values)
+    elif stage == 'kde':
+        import deskde
+        values = [desprobaplot.extract_rmsd_values(eaf_file, 2, holo_option) for holo_option in (1, 2, 3)]
+        run = lambda: deskde.kde_densities(values)
+    elif stage == 'generate_statistics':
+        import pandas as pd
+        import desMMGBSA
+        run = lambda: desMMGBSA.generate_statistics(desMMGBSA.filter_columns(pd.read_csv(mmgbsa_file).drop(columns=['title'])))
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    reset = _reset_peak_rss()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, _peak_rss_mb(reset)
+
+
+def measure(stage, files, repeat=1):
+    """
+    Run a stage in a freshly spawned process so its peak RSS is its own.
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_run_stage, (stage, files, repeat))
+
+
+def mmgbsa_rows(frames):
+    return max(10, frames // 20)
+
+
+def prepare_inputs(directory, size_mb, residues=300, noise_blocks=0):
+    """
+    Generate (or reuse) the synthetic inputs of one size and return their
+    paths and the .eaf frame count. The file names carry every generation
+    parameter, and each file is written under a temporary name first, so a
+    file is only reused if it was fully written with the same parameters.
+    """
+    frames = dessynth.frames_for_size(size_mb, noise_blocks)
+    stem = os.path.join(directory, f'synthetic_{size_mb:g}MB_{residues}res_{noise_blocks}noise')
+    files = (f'{stem}.eaf', f'{stem}_rg.csv', f'{stem}_mmgbsa.csv')
+    writers = (lambda path: dessynth.write_eaf(path, frames, residues, noise_blocks),
+               lambda path: dessynth.write_rg_csv(path, frames),
+               lambda path: dessynth.write_mmgbsa_csv(path, mmgbsa_rows(frames)))
+    os.makedirs(directory, exist_ok=True)
+    for file, write in zip(files, writers):
+        if not os.path.exists(file):
+            write(f'{file}.tmp')
+            os.replace(f'{file}.tmp', file)
+    return files, frames
+
+
+def run_benchmarks(directory, sizes, stages=STAGES, repeat=1, residues=300, noise_blocks=0):
+    results = []
+    for size in sizes:
+        files, frames = prepare_inputs(directory, size, residues, noise_blocks)
+        for stage in stages:
+            seconds, peak_mb = measure(stage, files, repeat)
+            rows = mmgbsa_rows(frames) if stage == 'generate_statistics' else frames  # Frames of the stage's own input
+            result = {'stage': stage, 'size_mb': size, 'frames': rows, 'wall_s': seconds,
+                      'peak_rss_mb': peak_mb, 'frames_per_s': rows / seconds if seconds else float('inf')}
+            results.append(result)
+            print(f"{stage:<24} {size:>8g} MB {seconds:>10.4f} s {peak_mb:>9.1f} MB RSS {result['frames_per_s']:>14.0f} frames/s")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Return the (stage, size, ratio) entries that got slower than the baseline
+    by more than tolerance (e.g. 0.2 for 20%).
+    """
+    reference = {(entry['stage'], entry['size_mb']): entry['wall_s'] for entry in baseline}
+    regressions = []
+    for entry in results:
+        key = (entry['stage'], entry['size_mb'])
+        if key in reference and reference[key] > 0:
+            ratio = entry['wall_s'] / reference[key]
+            if ratio > 1 + tolerance:
+                regressions.append((entry['stage'], entry['size_mb'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the extractors, statistics and KDE on synthetic Desmond outputs.")
+    parser.add_argument('--directory', default='bench_data', help="Where synthetic inputs are written and reused (default: bench_data).")
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 10, 100], metavar='MB',
+                        help="Sizes of the synthetic .eaf files, in MB (default: 1 10 100).")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per measurement (default: 1).")
+    parser.add_argument('--residues', type=int, default=300)
+    parser.add_argument('--noise-blocks', type=int, default=0)
+    parser.add_argument('--output', metavar='JSON', help="Write the results to this file.")
+    parser.add_argument('--baseline', metavar='JSON', help="Results of a previous run to compare with.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline before failing (default: 0.2).")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.directory, args.sizes, args.stages, args.repeat, args.residues, args.noise_blocks)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+        for stage, size, ratio in regressions:
+            print(f"Regression: {stage} at {size:g} MB is {ratio:.2f}x slower than the baseline")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+import argparse
+import functools
 import os
-import re
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+from desbatch import (HOLO_OPTIONS, STRUCTURE_TYPES, add_batch_arguments, add_figure_arguments, add_parallel_arguments,
+                      batch_entries, finish_figure, is_batch, make_parent_dir, use_headless_backend)
+from desparallel import map_files
+from desprofile import configure, timed
+from desstats import StreamingStats, merge_stats
+from deserror import error_metrics
+from deseaf import EafSyntaxError, load_block, rmsd_block, result_values
+from descompress import has_suffix
 
 def select_number_of_files():
     while True:
@@ -15,8 +22,9 @@ def select_number_of_files():
         except ValueError:
             print("Invalid input. Please enter a number.")
 
+@timed('list_files')
 def list_eaf_files():
-    eaf_files = [file for file in os.listdir() if file.endswith(".eaf")]
+    eaf_files = [file for file in os.listdir() if has_suffix(file, ".eaf")]
     return eaf_files
 
 def select_file(eaf_files):
@@ -44,64 +52,63 @@ def select_structure_type():
         except ValueError:
             print("Invalid input. Please enter a number.")
 
-def extract_rmsd_values(file_path, structure_type):
+def extract_rmsd_values(file_path, structure_type, holo_option=None, dtype=np.float64):
     if structure_type == 1:  # Apo
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            for i, line in enumerate(lines):
-                if 'ASL = "(((protein) and backbone) and not (atom.ele H) )"' in line:
-                    # Find the line with RMSD values after ASL
-                    for j in range(i+1, min(i+5, len(lines))):  # Search within the next 5 lines
-                        if "Result =" in lines[j]:
-                            try:
-                                rmsd_values = [float(val) for val in lines[j].split("[")[1].split("]")[0].split()]
-                                return rmsd_values
-                            except (IndexError, ValueError):
-                                return None
-            return None
+        selection = 'backbone'
     elif structure_type == 2:  # Holo
-        # Prompt user to select what to consider for building the PDF plot for holo structure
-        print("\nYour PDF plot for holo structure will be based on:")
-        print("1) Ligand fit by protein")
-        print("2) Ligand fit by ligand")
-        print("3) Bound protein's backbone")
-        user_choice = int(input("Enter the corresponding number: "))
+        if holo_option is None:
+            # Prompt user to select what to consider for building the PDF plot for holo structure
+            print("\nYour PDF plot for holo structure will be based on:")
+            print("1) Ligand fit by protein")
+            print("2) Ligand fit by ligand")
+            print("3) Bound protein's backbone")
+            holo_option = int(input("Enter the corresponding number: "))
         
-        # Define the variable based on user's choice
-        if user_choice == 1:
-            search_term = 'FitBy = "(protein)"'
-        elif user_choice == 2:
-            search_term = 'ASL = "at.n'
-        elif user_choice == 3:
-            search_term = 'ASL = "(((protein) and backbone) and not (atom.ele H)'
-
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            for i, line in enumerate(lines):
-                if search_term in line:
-                    # Find the line with RMSD values after the selected term
-                    for j in range(i+1, min(i+5, len(lines))):  # Search within the next 5 lines
-                        if "Result =" in lines[j]:
-                            try:
-                                rmsd_values = [float(val) for val in lines[j].split("[")[1].split("]")[0].split()]
-                                return rmsd_values
-                            except (IndexError, ValueError):
-                                return None
+        # Define the block to use based on the chosen option
+        if holo_option == 1:
+            selection = 'ligand_protein'
+        elif holo_option == 2:
+            selection = 'ligand_ligand'
+        elif holo_option == 3:
+            selection = 'backbone'
+        else:
             return None
     else:
         return None
 
-def plot_boxplot(rmsd_values_list, names):
-    plt.figure(figsize=(10, 6))
+    # Locate the block on the (cached) block index and parse only that block
+    try:
+        fields = load_block(file_path, lambda catalog: rmsd_block(catalog, selection), dtype)
+    except EafSyntaxError:
+        return None
+    return result_values(fields)
+
+@timed('render')
+def plot_boxplot(rmsd_values_list, names, output=None, formats=("png",), ax=None):
+    """
+    Draw the boxplots on ax (a panel of a larger figure), or on a new figure
+    that is then saved or shown.
+    """
+    import matplotlib.pyplot as plt
+    if ax is None:
+        plt.figure(figsize=(10, 6))
+    axes = ax if ax is not None else plt.gca()
     for i, rmsd_values in enumerate(rmsd_values_list):
-        plt.boxplot(rmsd_values, positions=[i], widths=0.6)
-    plt.ylabel('RMSD (Angstrom)')
-    plt.xticks(range(len(rmsd_values_list)), names, rotation=45)
-    plt.tight_layout()
-    plt.show()
+        axes.boxplot(rmsd_values, positions=[i], widths=0.6)
+    axes.set_ylabel('RMSD (Angstrom)')
+    axes.set_xticks(range(len(rmsd_values_list)), names, rotation=45)
+    if ax is None:
+        plt.tight_layout()
+        finish_figure(output, formats)
 
+@timed('statistics')
 def calculate_metrics(rmsd_values):
-    if rmsd_values:
+    if isinstance(rmsd_values, StreamingStats):  # Summary of a streamed or merged series
+        metrics = rmsd_values.metrics()
+        keys = ["Average", "Median", "Standard Deviation", "Minimum Value", "Maximum Value"]
+        return {key: metrics[key] for key in keys} if metrics else None
+    if rmsd_values is not None and len(rmsd_values):
+        rmsd_values = np.asarray(rmsd_values)
         metrics = {
             "Average": np.mean(rmsd_values),
             "Median": np.median(rmsd_values),
@@ -109,18 +116,72 @@ def calculate_metrics(rmsd_values):
             "Minimum Value": np.min(rmsd_values),
             "Maximum Value": np.max(rmsd_values)
         }
+        metrics.update(error_metrics(rmsd_values) or {})  # Frames are correlated: report honest errors of the mean
         return metrics
     else:
         return None
         
-def write_metrics_to_file(metrics, name):
-    with open("metrics.txt", "a") as file:
+def write_metrics_to_file(metrics, name, metrics_path="metrics.txt"):
+    make_parent_dir(metrics_path)
+    with open(metrics_path, "a") as file:
         file.write(f"Metrics for {name}:\n")
         for key, value in metrics.items():
             file.write(f"{key}: {value}\n")
         file.write("\n")
 
-def main():
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Build RMSD boxplots from Desmond .eaf files. Without batch options, the files are chosen interactively.")
+    group = add_batch_arguments(parser, kind='eaf')
+    group.add_argument('--structure', choices=STRUCTURE_TYPES, default='apo',
+                       help="Type of structure of every input (default: apo).")
+    group.add_argument('--holo', choices=HOLO_OPTIONS, default='protein',
+                       help="For holo structures: ligand fit by protein, ligand fit by ligand or the protein's backbone (default: protein).")
+    group.add_argument('--metrics', default='metrics.txt', metavar='PATH',
+                       help="File the metrics are appended to (default: metrics.txt).")
+    group.add_argument('--ensemble', metavar='NAME',
+                       help="Also write the metrics of all inputs merged into one ensemble under this name.")
+    add_parallel_arguments(group)
+    add_figure_arguments(group, 'boxplot')
+    return parser.parse_args(argv)
+
+def run_batch(args):
+    use_headless_backend()
+    structure_type = STRUCTURE_TYPES[args.structure]
+    holo_option = HOLO_OPTIONS[args.holo]
+    rmsd_values_list = []
+    names = []
+
+    entries = batch_entries(args)
+    extract = functools.partial(extract_rmsd_values, structure_type=structure_type, holo_option=holo_option)
+    results = map_files(extract, [selected_file for selected_file, _ in entries], args.workers, args.chunksize)
+
+    for (selected_file, name), rmsd_values in zip(entries, results):
+        if rmsd_values is not None:
+            rmsd_values_list.append(rmsd_values)
+            names.append(name)
+
+            metrics = calculate_metrics(rmsd_values)
+            if metrics:
+                write_metrics_to_file(metrics, name, args.metrics)
+        else:
+            print(f"Failed to extract RMSD values from {selected_file}. Skipping...")
+
+    if args.ensemble and rmsd_values_list:
+        ensemble = merge_stats(StreamingStats().update(rmsd_values) for rmsd_values in rmsd_values_list)
+        write_metrics_to_file(calculate_metrics(ensemble), args.ensemble, args.metrics)
+
+    if rmsd_values_list:
+        plot_boxplot(rmsd_values_list, names, args.output, args.formats)
+    else:
+        print("No valid RMSD values extracted. Exiting...")
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if is_batch(args):
+        run_batch(args)
+        return
+
     eaf_files = list_eaf_files()
     if not eaf_files:
         print("No .eaf files found in the directory.")
@@ -134,7 +195,7 @@ def main():
         selected_file = select_file(eaf_files)
         structure_type = select_structure_type()
         rmsd_values = extract_rmsd_values(selected_file, structure_type)
-        if rmsd_values:
+        if rmsd_values is not None:
             rmsd_values_list.append(rmsd_values)
             name = input("\nSelect a name for your plot: ")
             names.append(name)
@@ -152,7 +213,6 @@ def main():
 
 if __name__ == "__main__":
     main()
-    
-print(f"\nThank you! Goodbye!\n")
+    print(f"\nThank you! Goodbye!\n")
 
 
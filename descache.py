@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.environ.get('DESMOTOOLS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'desmotools'))
+CACHE_SIZE_LIMIT = int(os.environ.get('DESMOTOOLS_CACHE_SIZE', 1 << 30))
+HASH_SAMPLE = 1 << 20
+
+
+def cache_enabled():
+    return os.environ.get('DESMOTOOLS_NO_CACHE', '') in ('', '0')
+
+
+def file_signature(file_path):
+    """
+    Identify the current content of a file by its size, mtime and a hash of its
+    first and last megabyte, so that checking a multi-GB file stays cheap.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(HASH_SAMPLE))
+        if stat.st_size > HASH_SAMPLE:
+            file.seek(max(HASH_SAMPLE, stat.st_size - HASH_SAMPLE))
+            digest.update(file.read(HASH_SAMPLE))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+
+
+def _entry_path(file_path, variant, cache_dir):
+    key = json.dumps([os.path.abspath(file_path), variant])
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+
+def _encode(value, arrays):
+    """
+    Replace every ndarray in value by a reference to an entry of arrays so the
+    remaining structure can be stored as JSON.
+    """
+    if isinstance(value, np.ndarray):
+        name = f'a{len(arrays)}'
+        arrays[name] = value
+        return {'__array__': name}
+    if isinstance(value, dict):
+        return {key: _encode(item, arrays) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item, arrays) for item in value]
+    return value
+
+
+def _decode(value, arrays):
+    if isinstance(value, dict):
+        if '__array__' in value:
+            return arrays[value['__array__']]
+        return {key: _decode(item, arrays) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item, arrays) for item in value]
+    return value
+
+
+def load(file_path, variant, cache_dir=CACHE_DIR):
+    """
+    Return the catalog cached for file_path and variant, or None if there is
+    none or the file changed since it was stored.
+    """
+    entry = _entry_path(file_path, variant, cache_dir)
+    try:
+        with np.load(entry, allow_pickle=False) as data:
+            meta = json.loads(str(data['__meta__']))
+            if meta['signature'] != file_signature(file_path):
+                return None
+            arrays = {name: data[name] for name in data.files if name != '__meta__'}
+        os.utime(entry)  # Mark as recently used for the LRU eviction
+    except (OSError, KeyError, ValueError):
+        return None
+    return [(name, _decode(fields, arrays)) for name, fields in meta['catalog']]
+
+
+def store(file_path, variant, catalog, cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT):
+    """
+    Save a catalog as one compressed .npz entry, then evict the least recently
+    used entries until the cache fits in size_limit bytes.
+    """
+    arrays = {}
+    meta = {
+        'signature': file_signature(file_path),
+        'catalog': [[name, _encode(fields, arrays)] for name, fields in catalog],
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez_compressed(file, __meta__=np.array(json.dumps(meta)), **arrays)
+        os.replace(temp_path, _entry_path(file_path, variant, cache_dir))
+    except OSError:
+        return
+    prune(cache_dir, size_limit)
+
+
+def prune(cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT):
+    entries = []
+    try:
+        with os.scandir(cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npz'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= size_limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def clear(cache_dir=CACHE_DIR):
+    prune(cache_dir, 0)
@@ -0,0 +1,250 @@
+import argparse
+import csv
+import os
+import sqlite3
+
+from descompress import has_suffix, open_input
+from desparallel import map_files
+from desprofile import add_profile_arguments, configure, phase
+
+CATALOG_PATH = os.environ.get('DESMOTOOLS_CATALOG', 'desmotools.sqlite')
+SUFFIXES = ('.eaf', '.csv')
+KINDS = ['eaf', 'rg', 'mmgbsa', 'csv']
+SELECTIONS = ['backbone', 'ligand_protein', 'ligand_ligand', 'rmsf']
+FILTERS = ['kind', 'structure', 'selection', 'block', 'column', 'path']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    structure TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    asl TEXT,
+    fit_by TEXT,
+    selection_type TEXT,
+    unit TEXT
+);
+CREATE TABLE IF NOT EXISTS selections (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    selection TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS columns (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_path ON blocks(path);
+CREATE INDEX IF NOT EXISTS selections_selection ON selections(selection, path);
+CREATE INDEX IF NOT EXISTS columns_path ON columns(path);
+"""
+
+
+def connect(db_path=CATALOG_PATH):
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def walk(root):
+    """
+    Yield (path, size, mtime_ns) of every .eaf and .csv file below root, using
+    os.scandir so the sizes and times come from the directory listing. Hidden
+    directories and symbolic links to directories are not entered.
+    """
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print(f"Cannot list {directory}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    pending.append(entry.path)
+            elif has_suffix(entry.name, *SUFFIXES) and entry.is_file():
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def _scan_eaf(file_path):
+    from deseaf import LIGAND_ASL, load_block_index, rmsd_block, rmsf_block
+
+    catalog = [(name, entry['fields']) for name, entry in load_block_index(file_path)]  # Header fields only; cached for later loads
+    blocks = [(name, fields.get('ASL'), fields.get('FitBy'), fields.get('SelectionType'), fields.get('Unit'))
+              for name, fields in catalog]
+    selections = [selection for selection in SELECTIONS[:3] if rmsd_block(catalog, selection) is not None]
+    if rmsf_block(catalog) is not None:
+        selections.append('rmsf')
+    holo = any(name == 'RMSD' and str(asl or '').startswith(LIGAND_ASL) for name, asl, *_ in blocks)
+    return {'kind': 'eaf', 'structure': 'holo' if holo else 'apo', 'blocks': blocks, 'selections': selections,
+            'columns': []}
+
+
+def _scan_csv(file_path):
+    with open_input(file_path, 'r', newline='') as file:
+        columns = next(csv.reader(file), [])
+    if any('Radius of Gyration' in column for column in columns):
+        kind = 'rg'
+    elif any(column.startswith('r_psp_') for column in columns):
+        kind = 'mmgbsa'
+    else:
+        kind = 'csv'
+    return {'kind': kind, 'structure': None, 'blocks': [], 'selections': [], 'columns': columns}
+
+
+def scan_file(file_path):
+    """
+    Describe a file for the catalog: its kind (eaf, rg, mmgbsa or csv) and,
+    for .eaf files, the analysis blocks found by a header scan, the RMSD/RMSF
+    selections they offer and whether the system is apo or holo; for CSV
+    files, the header columns. A file that cannot be read is recorded with
+    its error.
+    """
+    from deseaf import EafSyntaxError
+
+    try:
+        return _scan_eaf(file_path) if has_suffix(file_path, '.eaf') else _scan_csv(file_path)
+    except (OSError, EOFError, UnicodeDecodeError, EafSyntaxError) as e:
+        return {'kind': 'eaf' if has_suffix(file_path, '.eaf') else 'csv', 'structure': None, 'blocks': [],
+                'selections': [], 'columns': [], 'error': f"{type(e).__name__}: {e}"}
+
+
+def _under(root):
+    root = root.rstrip(os.sep)
+    return 'path > ? AND path < ?', (root + os.sep, root + chr(ord(os.sep) + 1))
+
+
+def update_catalog(roots, db_path=CATALOG_PATH, workers=None, chunksize=8):
+    """
+    Walk every root and bring the catalog up to date: new files and files
+    whose size or modification time changed are scanned (in parallel), files
+    that disappeared are dropped, unchanged files are not opened at all.
+    Returns the numbers of (scanned, removed, unchanged) files.
+    """
+    connection = connect(db_path)
+    try:
+        changed, removed, unchanged = [], [], 0
+        with phase('walk'):
+            for root in roots:
+                where, bounds = _under(os.path.abspath(root))
+                known = {path: (size, mtime) for path, size, mtime
+                         in connection.execute(f'SELECT path, size, mtime_ns FROM files WHERE {where}', bounds)}
+                for path, size, mtime in walk(os.path.abspath(root)):
+                    if known.pop(path, None) == (size, mtime):
+                        unchanged += 1
+                    else:
+                        changed.append((path, size, mtime))
+                removed.extend(known)
+        results = map_files(scan_file, [path for path, _, _ in changed], workers, chunksize)
+        with phase('index'), connection:
+            connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            for (path, size, mtime), result in zip(changed, results):
+                connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                if result is None:
+                    continue
+                connection.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                   (path, result['kind'], size, mtime, result['structure'], result.get('error')))
+                connection.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                       [(path, i) + tuple(None if v is None else str(v) for v in block)
+                                        for i, block in enumerate(result['blocks'])])
+                connection.executemany('INSERT INTO selections VALUES (?, ?)',
+                                       [(path, selection) for selection in result['selections']])
+                connection.executemany('INSERT INTO columns VALUES (?, ?, ?)',
+                                       [(path, i, name) for i, name in enumerate(result['columns'])])
+        return len(changed), len(removed), unchanged
+    finally:
+        connection.close()
+
+
+def select_files(db_path=CATALOG_PATH, kind=None, structure=None, selection=None, block=None, column=None,
+                 path=None):
+    """
+    Return the sorted paths of the catalogued files matching every filter
+    given: kind, structure (apo or holo), an RMSD/RMSF selection, a block name,
+    a CSV column containing the text, and a glob on the path (e.g.
+    '*compoundX*'). Files that failed to scan are never returned.
+    """
+    if not os.path.exists(db_path):
+        raise SystemExit(f"No catalog at {db_path}; build it with descatalog.py scan.")
+    conditions, parameters = ['error IS NULL'], []
+    for value, condition in [
+            (kind, 'kind = ?'),
+            (structure, 'structure = ?'),
+            (selection, 'path IN (SELECT path FROM selections WHERE selection = ?)'),
+            (block, 'path IN (SELECT path FROM blocks WHERE name = ?)'),
+            (column, "path IN (SELECT path FROM columns WHERE instr(name, ?) > 0)"),
+            (path, 'path GLOB ?')]:
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    connection = connect(db_path)
+    try:
+        query = f"SELECT path FROM files WHERE {' AND '.join(conditions)} ORDER BY path"
+        return [row[0] for row in connection.execute(query, parameters)]
+    finally:
+        connection.close()
+
+
+def parse_filters(specs):
+    """
+    Turn KEY=VALUE strings into select_files keyword arguments.
+    """
+    filters = {}
+    for spec in specs:
+        key, separator, value = spec.partition('=')
+        if not separator or key not in FILTERS:
+            raise ValueError(f"Invalid filter '{spec}', expected KEY=VALUE with KEY one of {', '.join(FILTERS)}")
+        filters[key] = value
+    return filters
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain a SQLite catalog of the .eaf and CSV outputs below some directories, and select files from it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser('scan', help="Walk directories and add new or changed files to the catalog.")
+    scan.add_argument('roots', nargs='+', metavar='DIR', help="Directories to walk recursively.")
+    scan.add_argument('--workers', type=int, default=None, metavar='N',
+                      help="Number of worker processes scanning the files (default: one per CPU).")
+    scan.add_argument('--chunksize', type=int, default=8, metavar='N',
+                      help="Number of files handed to a worker at a time (default: 8).")
+
+    query = commands.add_parser('query', help="Print the catalogued files matching some filters, one per line.")
+    query.add_argument('--kind', choices=KINDS, help="Kind of file.")
+    query.add_argument('--structure', choices=['apo', 'holo'], help="Type of structure of the .eaf files.")
+    query.add_argument('--selection', choices=SELECTIONS, help="RMSD or RMSF selection the .eaf files must contain.")
+    query.add_argument('--block', metavar='NAME', help="Analysis block the .eaf files must contain (e.g. SSE).")
+    query.add_argument('--column', metavar='TEXT', help="Text a CSV column name must contain.")
+    query.add_argument('--path', metavar='GLOB', help="Glob the full path must match (e.g. '*compoundX*').")
+
+    for command in (scan, query):
+        command.add_argument('--catalog', default=CATALOG_PATH, metavar='DB',
+                             help=f"SQLite catalog file (default: {CATALOG_PATH}, or $DESMOTOOLS_CATALOG).")
+        add_profile_arguments(command)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if args.command == 'scan':
+        scanned, removed, unchanged = update_catalog(args.roots, args.catalog, args.workers, args.chunksize)
+        print(f"Scanned {scanned} files, removed {removed}, {unchanged} unchanged.")
+    else:
+        for path in select_files(args.catalog, args.kind, args.structure, args.selection, args.block, args.column,
+                                 args.path):
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import gzip
+import io
+import os
+import shutil
+import subprocess
+
+CODECS = {'.gz': 'gzip', '.zst': 'zstd'}
+PROGRAMS = {'gzip': [('pigz', '-dc'), ('gzip', '-dc')], 'zstd': [('zstd', '-dcq')]}
+PIPE_THRESHOLD = 8 << 20  # Smaller files are decompressed in-process, a new process would cost more than it saves
+BUFFER_SIZE = 1 << 20
+
+
+def compression(file_path):
+    """
+    Return the codec of a compressed input ('gzip' or 'zstd'), from its suffix,
+    or None for a plain file.
+    """
+    return CODECS.get(os.path.splitext(file_path)[1].lower())
+
+
+def strip_compression(file_path):
+    """
+    Drop a compression suffix: 'run.eaf.gz' -> 'run.eaf'.
+    """
+    return os.path.splitext(file_path)[0] if compression(file_path) else file_path
+
+
+def has_suffix(file_path, *suffixes):
+    """
+    True if file_path ends with one of suffixes, compressed or not.
+    """
+    return strip_compression(file_path).endswith(suffixes)
+
+
+class _PipeReader(io.RawIOBase):
+    """
+    Raw stream over the output of a decompression program, which runs in its
+    own process (pigz also checks and writes in separate threads) while this
+    one parses. Closing the stream early stops the program; a program failing
+    on its own raises OSError on close.
+    """
+
+    def __init__(self, command, file_path):
+        self.file_path = file_path
+        self.process = subprocess.Popen(command + [file_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.process.stdout.readinto(buffer)
+        if not size:
+            self.finished = True
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        self.process.stdout.close()
+        if not self.finished and self.process.poll() is None:
+            self.process.kill()
+        returncode = self.process.wait()
+        message = self.process.stderr.read().decode(errors='replace').strip()
+        self.process.stderr.close()
+        super().close()
+        if returncode > 0:
+            raise OSError(f"Decompressing {self.file_path} failed: {message or f'exit status {returncode}'}")
+
+
+def _program(codec):
+    for name, option in PROGRAMS[codec]:
+        path = shutil.which(name)
+        if path:
+            return [path, option]
+    return None
+
+
+def _zstd_reader(file_path):
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True),
+                             BUFFER_SIZE)
+
+
+def _decompressed(codec, file_path):
+    command = _program(codec)
+    if command and os.path.getsize(file_path) >= PIPE_THRESHOLD:
+        return io.BufferedReader(_PipeReader(command, file_path), BUFFER_SIZE)
+    if codec == 'gzip':
+        return gzip.open(file_path, 'rb')
+    reader = _zstd_reader(file_path)
+    if reader is not None:
+        return reader
+    if command:
+        return io.BufferedReader(_PipeReader(command, file_path), BUFFER_SIZE)
+    raise OSError(f"Reading {file_path} needs the zstandard package or the zstd program")
+
+
+def open_input(file_path, mode='rb', encoding=None, newline=None):
+    """
+    Open an input for reading, decompressing .gz and .zst files on the fly.
+    Large files are piped through pigz or zstd when installed, smaller ones
+    (or all, without those programs) are decompressed in-process with gzip or
+    the optional zstandard package. mode is 'rb' or 'r'.
+    """
+    codec = compression(file_path)
+    if codec is None:
+        return open(file_path, mode) if 'b' in mode else open(file_path, mode, encoding=encoding, newline=newline)
+    stream = _decompressed(codec, file_path)
+    return stream if 'b' in mode else io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+
+def skip(stream, size, chunk_size=BUFFER_SIZE):
+    """
+    Read and drop size bytes of a stream that may not be seekable.
+    """
+    while size > 0:
+        data = stream.read(min(size, chunk_size))
+        if not data:
+            break
+        size -= len(data)
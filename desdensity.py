@@ -0,0 +1,100 @@
+import numpy as np
+
+from desprofile import timed
+
+X_BINS = 800
+Y_BINS = 400
+ENVELOPES = (5, 50, 95)
+
+
+def _concatenate(series):
+    x = np.concatenate([np.asarray(x_values, dtype=np.float64) for x_values, _ in series])
+    y = np.concatenate([np.asarray(y_values, dtype=np.float64) for _, y_values in series])
+    curves = np.repeat(np.arange(len(series)), [len(y_values) for _, y_values in series])
+    finite = np.isfinite(x) & np.isfinite(y)
+    return x[finite], y[finite], curves[finite]
+
+
+def _range(values, padding=0.0):
+    low, high = float(values.min()), float(values.max())
+    if high <= low:
+        low, high = low - 0.5, high + 0.5
+    return low - padding, high + padding
+
+
+@timed('aggregate')
+def density_image(series, x_bins=X_BINS, y_bins=Y_BINS, x_range=None, y_range=None, normalize=True):
+    """
+    Rasterize many (x, y) series into one (y_bins, x_bins) image of point
+    counts with a single 2-D histogram, so drawing it costs the same whatever
+    the number of series. With normalize, every x column is divided by its
+    total, giving the fraction of frames at each value.
+    Returns (image, x_edges, y_edges).
+    """
+    x, y, _ = _concatenate(series)
+    if not x.size:
+        raise ValueError("No finite values to aggregate")
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=(x_bins, y_bins),
+                                              range=(x_range or _range(x), y_range or _range(y)))
+    if normalize:
+        totals = counts.sum(axis=1, keepdims=True)
+        np.divide(counts, totals, out=counts, where=totals > 0)
+    return counts.T, x_edges, y_edges
+
+
+def binned_curves(series, x_edges):
+    """
+    Mean of every series within each x bin, as a (series, bins) matrix with NaN
+    where a series has no point in a bin.
+    """
+    x, y, curves = _concatenate(series)
+    bins = len(x_edges) - 1
+    column = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0, bins - 1)
+    cell = curves * bins + column
+    sums = np.bincount(cell, weights=y, minlength=len(series) * bins)
+    counts = np.bincount(cell, minlength=len(series) * bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).reshape(len(series), bins)
+
+
+def nan_percentiles(matrix, percentiles):
+    """
+    Percentiles (linear interpolation, as np.percentile) of every column of
+    matrix ignoring NaN, computed with one sort instead of np.nanpercentile's
+    column-by-column fallback. Columns without values give NaN.
+    """
+    ordered = np.sort(matrix, axis=0)  # NaN sort last
+    valid = np.sum(~np.isnan(matrix), axis=0)
+    positions = np.asarray(percentiles, dtype=np.float64)[:, None] / 100 * np.maximum(valid - 1, 0)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(valid - 1, 0))
+    columns = np.arange(matrix.shape[1])
+    fraction = positions - lower
+    result = ordered[lower, columns] * (1 - fraction) + ordered[upper, columns] * fraction
+    result[:, valid == 0] = np.nan
+    return result
+
+
+@timed('render')
+def plot_density(series, x_label, y_label, title=None, envelopes=ENVELOPES, x_bins=X_BINS, y_bins=Y_BINS,
+                 x_range=None, ax=None, cmap='viridis', density_label='Fraction of frames'):
+    """
+    Draw many series as one density image, with optional percentile envelopes
+    computed from the per-bin means of every series.
+    """
+    import matplotlib.pyplot as plt
+    axes = ax if ax is not None else plt.gca()
+    image, x_edges, y_edges = density_image(series, x_bins, y_bins, x_range)
+    shown = axes.imshow(np.ma.masked_equal(image, 0), origin='lower', aspect='auto', cmap=cmap, interpolation='nearest',
+                        extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]))
+    axes.figure.colorbar(shown, ax=axes, label=density_label)
+    if envelopes:
+        centers = (x_edges[:-1] + x_edges[1:]) / 2
+        for percentile, values in zip(envelopes, nan_percentiles(binned_curves(series, x_edges), envelopes)):
+            axes.plot(centers, values, color='black' if percentile == 50 else 'tab:red',
+                      linestyle='-' if percentile == 50 else '--', linewidth=1, label=f'{percentile:g}th percentile')
+        axes.legend()
+    axes.set_xlabel(x_label)
+    axes.set_ylabel(y_label)
+    if title:
+        axes.set_title(f'{title} ({len(series)} curves)')
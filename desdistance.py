@@ -0,0 +1,176 @@
+import csv
+import os
+
+import numpy as np
+
+from desbatch import make_parent_dir
+from desprofile import timed
+
+BLOCK_BYTES = 4 << 20  # Size of the (rows, datasets, points) arrays of one batch of pairs, small enough to stay in cache
+METRICS = ('ks', 'wasserstein', 'js')
+
+
+def _sorted_sets(datasets):
+    return [np.sort(np.asarray(values, dtype=np.float64)) for values in datasets]
+
+
+def _row_blocks(n, points, block_bytes=BLOCK_BYTES):
+    """
+    Split the rows of an upper-triangular n x n pair matrix into batches whose
+    (rows, columns, points) arrays fit in block_bytes.
+    """
+    rows = max(1, block_bytes // (8 * max(n, 1) * max(points, 1)))
+    return [(start, min(start + rows, n)) for start in range(0, n, rows)]
+
+
+def _mirror(matrix):
+    upper = np.triu(matrix, 1)
+    return upper + upper.T
+
+
+def ks_distances(sorted_sets):
+    """
+    Exact two-sample Kolmogorov-Smirnov distance matrix of sorted arrays.
+    Between two points of dataset j its ECDF is constant while the one of i
+    only grows, so the supremum of |F_i - F_j| is reached at a point of j,
+    either at its value or at its left limit. KS only depends on the order of
+    the values, so they are replaced by their ranks among all pooled values
+    (few and cache-friendly for .eaf data written to 4 decimals); each row i
+    then reads its ECDF at the points of every later dataset from one
+    cumulative count table, and the maxima per dataset come from one reduceat.
+    """
+    n = len(sorted_sets)
+    if n < 2:
+        return np.zeros((n, n))
+    lengths = np.array([len(values) for values in sorted_sets])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    distinct, ranks = np.unique(np.concatenate(sorted_sets), return_inverse=True)
+    ranks = ranks.astype(np.int32) + 1  # Slot 0 of the count table stands for "below every value"
+    own_right = np.concatenate([np.searchsorted(values, values, side='right') / len(values) for values in sorted_sets])
+    own_left = np.concatenate([np.searchsorted(values, values, side='left') / len(values) for values in sorted_sets])
+    ks = np.zeros((n, n))
+    at_most = np.zeros(len(distinct) + 1, dtype=np.int32)
+    for i in range(n - 1):
+        at_most[1:] = np.cumsum(np.bincount(ranks[offsets[i]:offsets[i + 1]] - 1, minlength=len(distinct)))
+        points = ranks[offsets[i + 1]:]
+        right = at_most[points] * (1 / lengths[i])
+        right -= own_right[offsets[i + 1]:]
+        np.abs(right, out=right)
+        left = at_most[points - 1] * (1 / lengths[i])
+        left -= own_left[offsets[i + 1]:]
+        np.abs(left, out=left)
+        np.maximum(right, left, out=right)
+        ks[i, i + 1:] = np.maximum.reduceat(right, offsets[i + 1:-1] - offsets[i + 1])
+    return _mirror(ks)
+
+
+def wasserstein_distances(sorted_sets, block_bytes=BLOCK_BYTES):
+    """
+    Exact Wasserstein-1 distance matrix of sorted arrays: the area between
+    two ECDFs, which are constant between consecutive pooled distinct values,
+    so it is the sum of |F_i - F_j| times the gap to the next value over that
+    grid. The ECDFs are built a chunk of grid columns at a time from running
+    counts of the values' ranks, and the pairs are computed a batch of rows
+    at a time, each row against the rows below it only, so memory stays
+    within block_bytes whatever the lengths of the datasets.
+    """
+    n = len(sorted_sets)
+    wasserstein = np.zeros((n, n))
+    if n < 2:
+        return wasserstein
+    lengths = np.array([len(values) for values in sorted_sets])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    distinct, ranks = np.unique(np.concatenate(sorted_sets), return_inverse=True)
+    widths = np.append(np.diff(distinct), 0.0)  # Past the largest value both ECDFs are 1
+    columns = max(256, block_bytes // (8 * n))
+    bounds = [np.searchsorted(ranks[offsets[i]:offsets[i + 1]], np.arange(0, len(distinct) + columns, columns))
+              for i in range(n)]  # Each dataset's ranks are sorted: where every chunk of columns starts
+    below = np.zeros(n)
+    ecdfs = np.empty((n, columns))
+    for number, start in enumerate(range(0, len(distinct), columns)):
+        size = min(columns, len(distinct) - start)
+        chunk = ecdfs[:, :size]
+        for i, row in enumerate(chunk):
+            first, last = bounds[i][number:number + 2]
+            counts = np.bincount(ranks[offsets[i] + first:offsets[i] + last] - start, minlength=size)
+            np.cumsum(counts, out=row)
+            row += below[i]
+            below[i] = row[-1]
+        chunk /= lengths[:, None]
+        for first, last in _row_blocks(n, size, block_bytes):
+            difference = np.abs(chunk[first:last, None, :] - chunk[None, first:, :])
+            wasserstein[first:last, first:] += difference @ widths[start:start + size]
+    return _mirror(wasserstein)
+
+
+def _entropy(probabilities):
+    """
+    Shannon entropy in bits along the last axis, with 0 log 0 = 0.
+    """
+    logs = np.log2(probabilities + np.finfo(probabilities.dtype).tiny)  # Cheaper than masking the zeros
+    return -np.einsum('...k,...k->...', probabilities, logs)
+
+
+def js_divergences(densities, block_bytes=BLOCK_BYTES):
+    """
+    Jensen-Shannon divergence matrix, in bits (0 to 1), between densities
+    sampled on one shared grid, e.g. the KDE rows of deskde.kde_densities.
+    Uses JS(P, Q) = H((P + Q) / 2) - (H(P) + H(Q)) / 2, so only the entropy of
+    each mixture is computed per pair.
+    """
+    masses = np.asarray(densities, dtype=np.float64)
+    totals = masses.sum(axis=1, keepdims=True)
+    masses = masses / np.where(totals > 0, totals, 1)
+    n, points = masses.shape
+    entropies = _entropy(masses)
+    js = np.zeros((n, n))
+    for start, stop in _row_blocks(n, points, block_bytes):
+        mixtures = masses[start:stop, None, :] + masses[None, start:, :]
+        mixtures *= 0.5
+        js[start:stop, start:] = (_entropy(mixtures)
+                                  - (entropies[start:stop, None] + entropies[None, start:]) / 2)
+    return np.clip(_mirror(js), 0, 1)
+
+
+@timed('compare')
+def distance_matrices(datasets, densities=None):
+    """
+    Pairwise N x N Kolmogorov-Smirnov, Wasserstein-1 and Jensen-Shannon
+    matrices of datasets, keyed by METRICS. KS and Wasserstein are exact,
+    from the sorted datasets; densities are the datasets' KDEs on a shared
+    grid, computed with deskde.kde_densities when not given.
+    """
+    if densities is None:
+        from deskde import kde_densities
+        _, densities, _ = kde_densities(datasets)
+    sorted_sets = _sorted_sets(datasets)
+    return {'ks': ks_distances(sorted_sets), 'wasserstein': wasserstein_distances(sorted_sets),
+            'js': js_divergences(densities)}
+
+
+def export_matrix(file_path, matrix, names):
+    """
+    Write a square matrix to a CSV file with the names as header and first
+    column, ready for a heatmap (e.g. pandas.read_csv(path, index_col=0)).
+    """
+    make_parent_dir(file_path)
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([''] + list(names))
+        for name, row in zip(names, matrix):
+            writer.writerow([name] + [repr(float(value)) for value in row])
+
+
+def export_matrices(file_path, matrices, names):
+    """
+    Write every matrix of distance_matrices next to file_path, one CSV per
+    metric: 'rmsd.csv' gives rmsd_ks.csv, rmsd_wasserstein.csv and rmsd_js.csv.
+    Returns the paths written.
+    """
+    stem, extension = os.path.splitext(file_path)
+    paths = []
+    for metric, matrix in matrices.items():
+        path = f'{stem}_{metric}{extension or ".csv"}'
+        export_matrix(path, matrix, names)
+        paths.append(path)
+    return paths
@@ -0,0 +1,105 @@
+import numpy as np
+
+from desprofile import count
+
+METHODS = ['minmax', 'lttb', 'none']
+POINTS_PER_PIXEL = 2
+
+
+def _first_in_bucket(mask, bucket):
+    """
+    Index of the first True of mask in every bucket.
+    """
+    indices = np.flatnonzero(mask)
+    _, first = np.unique(bucket[indices], return_index=True)
+    return indices[first]
+
+
+def minmax_indices(y, buckets):
+    """
+    Indices of the minimum and maximum of y in each of buckets equal-width
+    index buckets, plus the first and last points, in order. Every peak
+    survives, whatever the number of points.
+    """
+    y = np.asarray(y)
+    n = len(y)
+    if n <= 2 * buckets + 2:
+        return np.arange(n)
+    starts = (np.arange(buckets) * n) // buckets
+    sizes = np.diff(np.append(starts, n))
+    bucket = np.repeat(np.arange(buckets), sizes)
+    lows = _first_in_bucket(y == np.repeat(np.minimum.reduceat(y, starts), sizes), bucket)
+    highs = _first_in_bucket(y == np.repeat(np.maximum.reduceat(y, starts), sizes), bucket)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the n_out points chosen by Largest-Triangle-Three-Buckets.
+    Bucket averages are computed for all buckets at once; the selection itself
+    runs once per bucket (each choice anchors the next), so its cost follows
+    the output size, not the input size.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    buckets = n_out - 2
+    edges = 1 + (np.arange(buckets + 1) * (n - 2)) // buckets
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / sizes
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / sizes
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for b in range(buckets):
+        low, high = edges[b], edges[b + 1]
+        area = np.abs((x[anchor] - next_x[b]) * (y[low:high] - y[anchor])
+                      - (x[anchor] - x[low:high]) * (next_y[b] - y[anchor]))
+        anchor = low + int(np.argmax(area))
+        selected[b + 1] = anchor
+    return selected
+
+
+def downsample(x, y, n_out, method='minmax'):
+    """
+    Reduce (x, y) to about n_out points with 'minmax' or 'lttb'; 'none', or a
+    series already short enough, is returned unchanged. Non-finite points are
+    dropped first.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == 'none' or len(y) <= n_out:
+        return x, y
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    if method == 'lttb':
+        indices = lttb_indices(x, y, n_out)
+    elif method == 'minmax':
+        indices = minmax_indices(y, max(1, n_out // 2))
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    count('points_dropped', len(y) - len(indices))
+    return x[indices], y[indices]
+
+
+def axes_points(axes, points_per_pixel=POINTS_PER_PIXEL):
+    """
+    Number of points worth drawing across axes: a few per horizontal pixel of
+    the axes at the figure's resolution.
+    """
+    figure = axes.figure
+    width = figure.get_figwidth() * figure.dpi * axes.get_position().width
+    return max(16, int(width * points_per_pixel))
+
+
+def plot_line(axes, x, y, method='minmax', **kwargs):
+    """
+    axes.plot(x, y) after downsampling the series to the width of axes.
+    """
+    x, y = downsample(x, y, axes_points(axes), method)
+    return axes.plot(x, y, **kwargs)
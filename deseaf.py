@@ -0,0 +1,593 @@
+import io
+import mmap
+import re
+import warnings
+
+import numpy as np
+
+import descache
+from descompress import compression, open_input, skip
+from desprofile import count, phase
+
+CHUNK_SIZE = 1 << 20
+
+BACKBONE_ASL = '(((protein) and backbone) and not (atom.ele H)'
+LIGAND_ASL = 'at.n'
+PROTEIN_FIT = '(protein)'
+CONTACTS_BLOCK = 'ProtLigInter'
+SSE_BLOCKS = ('SSE', 'SecondaryStructure')
+
+_TOKEN = re.compile(rb'\s*(?:([{}\[\]=])|"((?:[^"\\]|\\.)*)"|([^\s{}\[\]="]+))')
+_SPACE = re.compile(rb'\s*')
+_STRING = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+_NESTING = re.compile(rb'[\[\]{}"]')
+
+
+class EafSyntaxError(ValueError):
+    pass
+
+
+class _Tokenizer:
+    """
+    Chunked tokenizer for the nested `{ key = value }` layout of .eaf files.
+    Only one chunk (plus the token being read) is held in memory at a time.
+    """
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        count('bytes_read', len(chunk))
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next(self):
+        """
+        Return the next token as a (kind, value) tuple, or None at end of file.
+        Kind is the punctuation itself, 'string' or 'word'.
+        """
+        while True:
+            match = _TOKEN.match(self.buffer, self.pos)
+            if match and match.end() < len(self.buffer):
+                break
+            if not self._fill():
+                if match:
+                    break
+                if self.buffer[self.pos:].strip():
+                    raise EafSyntaxError(f"Unexpected data at byte {self.offset + self.pos}")
+                return None
+        self.pos = match.end()
+        punctuation, string, word = match.groups()
+        if punctuation is not None:
+            return punctuation.decode(), None
+        if string is not None:
+            return 'string', _decode_string(string)
+        return 'word', word.decode()
+
+    def read_array(self, keep=True):
+        """
+        Called right after a '[' token. If the list holds scalars, consume it up to
+        the matching ']' and return its raw payload (or b'' when keep is False).
+        Return None, consuming nothing, when the list holds nested blocks.
+        """
+        while True:
+            self.pos = _SPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                break
+            if not self._fill():
+                raise EafSyntaxError("Unterminated list at end of file")
+        if self.buffer[self.pos:self.pos + 1] in (b'{', b'['):
+            return None
+
+        parts = []
+        while True:
+            close = self.buffer.find(b']', self.pos)
+            quote = self.buffer.find(b'"', self.pos, close if close >= 0 else len(self.buffer))
+            if quote >= 0:
+                match = _STRING.match(self.buffer, quote)
+                if match:
+                    end = match.end()
+                    if keep:
+                        parts.append(self.buffer[self.pos:end])
+                    self.pos = end
+                    continue
+                if keep:
+                    parts.append(self.buffer[self.pos:quote])
+                self.pos = quote
+            elif close >= 0:
+                if keep:
+                    parts.append(self.buffer[self.pos:close])
+                self.pos = close + 1
+                return b''.join(parts)
+            else:
+                if keep:
+                    parts.append(self.buffer[self.pos:])
+                self.pos = len(self.buffer)
+            if not self._fill():
+                raise EafSyntaxError("Unterminated list at end of file")
+
+
+    def skip_list(self):
+        """
+        Called when read_array returned None: skip the nested list up to its
+        matching ']' by looking only at brackets and strings, without
+        tokenizing its content.
+        """
+        depth = 1
+        while True:
+            match = _NESTING.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+            elif match.group() == b'"':
+                string = _STRING.match(self.buffer, match.start())
+                if string is not None:
+                    self.pos = string.end()
+                    continue
+                self.pos = match.start()  # The string goes on in the next chunk
+            else:
+                self.pos = match.end()
+                depth += 1 if match.group() in (b'[', b'{') else -1
+                if not depth:
+                    return
+                continue
+            if not self._fill():
+                raise EafSyntaxError("Unterminated list at end of file")
+
+
+def _decode_string(raw):
+    return raw.decode('utf-8', 'replace').replace('\\"', '"')
+
+
+def _parse_array(raw, dtype=np.float64):
+    """
+    Turn the payload of a scalar list into a list of strings or, when every item
+    is a number, into an ndarray parsed in bulk by NumPy.
+    """
+    if b'"' in raw:
+        return [_decode_string(match.group(1)) for match in _STRING.finditer(raw)]
+    if not raw.strip():
+        return np.empty(0, dtype=dtype)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            values = np.fromstring(raw, dtype=dtype, sep=' ')
+        count('values_parsed', values.size)
+        return values
+    except (ValueError, DeprecationWarning):
+        return [word.decode('utf-8', 'replace') for word in raw.split()]
+
+
+class _CatalogParser:
+    """
+    Walks the token stream once. Every `{NAME = { ... }}` entry of a list is an
+    analysis block; blocks whose name is not in block_types are skipped without
+    being materialized. With headers_only, the lists inside blocks (Result,
+    ProteinResidues, ...) are skipped as well and read as None, and the byte
+    range of every block and of each of its lists is recorded in spans.
+    """
+
+    def __init__(self, tokens, block_types=None, dtype=np.float64, headers_only=False):
+        self.tokens = tokens
+        self.dtype = dtype
+        self.headers_only = headers_only
+        self.block_types = set(block_types) if block_types is not None else None
+        self.catalog = []
+        self.spans = []
+
+    def _expect(self, kind):
+        token = self.tokens.next()
+        if token is None or token[0] != kind:
+            raise EafSyntaxError(f"Expected '{kind}' near byte {self.tokens.offset + self.tokens.pos}, got {token}")
+        return token
+
+    def _position(self):
+        return self.tokens.offset + self.tokens.pos
+
+    def _key(self, token):
+        if token is None or token[0] not in ('word', 'string'):
+            raise EafSyntaxError(f"Expected a key near byte {self.tokens.offset + self.tokens.pos}, got {token}")
+        return token[1]
+
+    def parse(self):
+        token = self.tokens.next()
+        if token is not None and token[0] == '{':
+            self._walk_dict()
+            return self.catalog
+        while token is not None:
+            self._key(token)
+            self._expect('=')
+            self._walk_value()
+            token = self.tokens.next()
+        return self.catalog
+
+    def parse_value(self):
+        """
+        Parse a token stream holding a single value, such as the byte range of
+        one block (giving its fields) or of one list.
+        """
+        return self._parse_value()
+
+    # Walking: outside analysis blocks, only look for more blocks.
+    def _walk_value(self):
+        kind, value = self._expect_value()
+        if kind == '{':
+            self._walk_dict()
+        elif kind == '[':
+            if self.tokens.read_array(keep=False) is None:
+                self._walk_list()
+
+    def _expect_value(self):
+        token = self.tokens.next()
+        if token is None or token[0] not in ('{', '[', 'word', 'string'):
+            raise EafSyntaxError(f"Expected a value near byte {self.tokens.offset + self.tokens.pos}, got {token}")
+        return token
+
+    def _walk_dict(self):
+        while True:
+            token = self.tokens.next()
+            if token is not None and token[0] == '}':
+                return
+            self._key(token)
+            self._expect('=')
+            self._walk_value()
+
+    def _walk_list(self):
+        while True:
+            token = self.tokens.next()
+            if token is None:
+                raise EafSyntaxError("Unterminated list at end of file")
+            kind = token[0]
+            if kind == ']':
+                return
+            if kind == '{':
+                self._walk_entry()
+            elif kind == '[':
+                if self.tokens.read_array(keep=False) is None:
+                    self._walk_list()
+
+    def _walk_entry(self):
+        while True:
+            token = self.tokens.next()
+            if token is not None and token[0] == '}':
+                return
+            name = self._key(token)
+            self._expect('=')
+            kind, value = self._expect_value()
+            if kind == '{':
+                if self.block_types is None or name in self.block_types:
+                    start, lists = self._position() - 1, {}
+                    self.catalog.append((name, self._parse_dict(lists if self.headers_only else None)))
+                    if self.headers_only:
+                        self.spans.append({'span': (start, self._position()), 'lists': lists})
+                else:
+                    self._skip_nested()
+            elif kind == '[':
+                if self.tokens.read_array(keep=False) is None:
+                    self._walk_list()
+
+    def _skip_nested(self):
+        depth = 1
+        while depth:
+            token = self.tokens.next()
+            if token is None:
+                raise EafSyntaxError("Unterminated block at end of file")
+            kind = token[0]
+            if kind == '{':
+                depth += 1
+            elif kind == '}':
+                depth -= 1
+            elif kind == '[':
+                if self.tokens.read_array(keep=False) is None:
+                    depth += 1
+            elif kind == ']':
+                depth -= 1
+
+    # Parsing: inside a wanted block, materialize every value.
+    def _parse_value(self):
+        kind, value = self._expect_value()
+        if kind == '{':
+            return self._parse_dict()
+        if kind == '[':
+            raw = self.tokens.read_array(keep=not self.headers_only)
+            if self.headers_only:
+                if raw is None:
+                    self.tokens.skip_list()
+                return None
+            if raw is None:
+                return self._parse_list()
+            return _parse_array(raw, self.dtype)
+        return value
+
+    def _parse_dict(self, lists=None):
+        fields = {}
+        while True:
+            token = self.tokens.next()
+            if token is not None and token[0] == '}':
+                return fields
+            key = self._key(token)
+            self._expect('=')
+            start = self._position()
+            fields[key] = self._parse_value()
+            if lists is not None and fields[key] is None:
+                lists[key] = (start, self._position())
+
+    def _parse_list(self):
+        items = []
+        while True:
+            token = self.tokens.next()
+            if token is None:
+                raise EafSyntaxError("Unterminated list at end of file")
+            kind, value = token
+            if kind == ']':
+                return items
+            if kind == '{':
+                items.append(self._parse_dict())
+            elif kind == '[':
+                raw = self.tokens.read_array()
+                items.append(self._parse_list() if raw is None else _parse_array(raw, self.dtype))
+            elif kind in ('word', 'string'):
+                items.append(value)
+            else:
+                raise EafSyntaxError(f"Unexpected '{kind}' in list")
+
+
+def read_catalog(file_path, block_types=None, dtype=np.float64):
+    """
+    Read an .eaf file in a single streaming pass and return its analysis blocks
+    as a list of (name, fields) tuples in file order, e.g. ('RMSD', {'ASL': ...,
+    'Result': ndarray}). Pass block_types to keep only blocks with those names,
+    and dtype (e.g. np.float32) to choose the precision of numeric arrays.
+    """
+    with phase('parse'), open_input(file_path) as file:
+        return _CatalogParser(_Tokenizer(file), block_types, dtype).parse()
+
+
+def read_headers(file_path):
+    """
+    Scan an .eaf file for its analysis blocks and their scalar fields (ASL,
+    FitBy, Unit, ...), without parsing any list; list fields read as None.
+    Much cheaper than read_catalog when only the layout of the file matters.
+    """
+    with phase('scan'), open_input(file_path) as file:
+        return _CatalogParser(_Tokenizer(file), headers_only=True).parse()
+
+
+def read_block_index(file_path):
+    """
+    Header scan that also records where every block lies in the file: a list
+    of (name, {'fields': header fields, 'span': (start, end), 'lists': {key:
+    (start, end)}}) tuples, the spans being byte ranges of the block and of
+    each of its list fields.
+    """
+    with phase('scan'), open_input(file_path) as file:
+        parser = _CatalogParser(_Tokenizer(file), headers_only=True)
+        parser.parse()
+    return [(name, dict(entry, fields=fields)) for (name, fields), entry in zip(parser.catalog, parser.spans)]
+
+
+def load_block_index(file_path, use_cache=True):
+    """
+    Same as read_block_index, but reuse the index cached by a previous call as
+    long as the file has not changed (see descache).
+    """
+    if not use_cache or not descache.cache_enabled():
+        return read_block_index(file_path)
+    with phase('cache_load'):
+        index = descache.load(file_path, ['index'])
+    if index is None:
+        index = read_block_index(file_path)
+        descache.store(file_path, ['index'], index)
+    return index
+
+
+def read_span(file_path, span):
+    """
+    Return the bytes of span from a memory map of the file, so that only the
+    pages of that range are read. Compressed files cannot be mapped and are
+    decompressed up to the end of the span instead.
+    """
+    start, end = span
+    if compression(file_path):
+        with open_input(file_path) as file:
+            skip(file, start)
+            data = file.read(end - start)
+    else:
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            data = view[start:end]
+    if len(data) < end - start:
+        raise EafSyntaxError(f"{file_path} is shorter than its block index")
+    count('bytes_read', len(data))
+    return data
+
+
+def read_block(file_path, entry, dtype=np.float64):
+    """
+    Parse the fields of one block of a block index from its byte range only.
+    """
+    return _parse_span(file_path, entry['span'], dtype)
+
+
+def _load_span(file_path, span, dtype, use_cache):
+    """
+    Parse the value at span (a block or one of its lists), reusing the result
+    cached for that span and dtype as long as the file has not changed.
+    """
+    if not use_cache or not descache.cache_enabled():
+        return _parse_span(file_path, span, dtype)
+    variant = ['span', list(span), np.dtype(dtype).str]
+    with phase('cache_load'):
+        cached = descache.load(file_path, variant)
+    if cached is not None:
+        return cached[0][1]
+    value = _parse_span(file_path, span, dtype)
+    descache.store(file_path, variant, [('value', value)])
+    return value
+
+
+def _parse_span(file_path, span, dtype):
+    with phase('parse_block'):
+        return _CatalogParser(_Tokenizer(io.BytesIO(read_span(file_path, span))), dtype=dtype).parse_value()
+
+
+def _find_entry(file_path, find, use_cache):
+    index = load_block_index(file_path, use_cache)
+    headers = find([(name, entry['fields']) for name, entry in index])
+    for _, entry in index:
+        if entry['fields'] is headers:
+            return entry
+    return None
+
+
+def load_blocks(file_path, find_all, dtype=np.float64, use_cache=True):
+    """
+    Same as load_block for a selector returning several blocks (e.g.
+    torsion_blocks); returns the list of their fields in file order.
+    """
+    index = load_block_index(file_path, use_cache)
+    wanted = {id(fields) for fields in find_all([(name, entry['fields']) for name, entry in index])}
+    return [_load_span(file_path, entry['span'], dtype, use_cache) for _, entry in index
+            if id(entry['fields']) in wanted]
+
+
+def load_block(file_path, find, dtype=np.float64, use_cache=True):
+    """
+    Locate a block on the header index with find(catalog), any of the
+    selectors below (e.g. lambda catalog: rmsf_block(catalog)), and parse only
+    that block, so the cost does not grow with the rest of the file. The
+    parsed block is cached too, so repeat calls skip the parse. Returns its
+    fields, or None.
+    """
+    entry = _find_entry(file_path, find, use_cache)
+    return None if entry is None else _load_span(file_path, entry['span'], dtype, use_cache)
+
+
+def load_list(file_path, find, key='Result', dtype=np.float64, use_cache=True):
+    """
+    Same as load_block, but parse only the key list of the block (its Result
+    series by default). Returns None if the block or the list is missing.
+    """
+    entry = _find_entry(file_path, find, use_cache)
+    if entry is None or key not in entry['lists']:
+        return None
+    return _load_span(file_path, entry['lists'][key], dtype, use_cache)
+
+
+def load_catalog(file_path, block_types=None, dtype=np.float64, use_cache=True):
+    """
+    Same as read_catalog, but reuse the arrays cached by a previous call as long
+    as the file has not changed (see descache).
+    """
+    if not use_cache or not descache.cache_enabled():
+        return read_catalog(file_path, block_types, dtype)
+    variant = [sorted(block_types) if block_types is not None else None, np.dtype(dtype).str]
+    with phase('cache_load'):
+        catalog = descache.load(file_path, variant)
+    if catalog is None:
+        catalog = read_catalog(file_path, block_types, dtype)
+        descache.store(file_path, variant, catalog)
+    return catalog
+
+
+def find_block(catalog, name, predicate=None):
+    """
+    Return the fields of the first block called name that satisfies predicate.
+    """
+    for block_name, fields in catalog:
+        if block_name == name and (predicate is None or predicate(fields)):
+            return fields
+    return None
+
+
+def _starts_with(fields, key, prefix):
+    value = fields.get(key)
+    return isinstance(value, str) and value.startswith(prefix)
+
+
+def rmsd_block(catalog, selection='backbone'):
+    """
+    Return the RMSD block for one of the selections offered by the scripts:
+    'backbone' (protein backbone), 'ligand_protein' (ligand fit by protein) or
+    'ligand_ligand' (ligand fit by ligand).
+    """
+    if selection == 'backbone':
+        return find_block(catalog, 'RMSD', lambda fields: _starts_with(fields, 'ASL', BACKBONE_ASL))
+    if selection == 'ligand_protein':
+        return find_block(catalog, 'RMSD', lambda fields: fields.get('FitBy') == PROTEIN_FIT)
+    if selection == 'ligand_ligand':
+        return find_block(catalog, 'RMSD', lambda fields: _starts_with(fields, 'ASL', LIGAND_ASL)
+                          and fields.get('FitBy') != PROTEIN_FIT)
+    raise ValueError(f"Unknown RMSD selection: {selection}")
+
+
+def rmsf_block(catalog):
+    """
+    Return the protein RMSF block fitted on the backbone.
+    """
+    return find_block(catalog, 'RMSF', lambda fields: _starts_with(fields, 'FitBy', BACKBONE_ASL))
+
+
+def contacts_block(catalog):
+    """
+    Return the protein-ligand interactions block, whose *Result lists (HBond,
+    Hydrophobic, WaterBridge, ...) hold the contacts of every frame.
+    """
+    return find_block(catalog, CONTACTS_BLOCK)
+
+
+def sse_block(catalog):
+    """
+    Return the per-frame secondary structure block.
+    """
+    for name in SSE_BLOCKS:
+        fields = find_block(catalog, name)
+        if fields is not None:
+            return fields
+    return None
+
+
+def torsion_blocks(catalog):
+    """
+    Return every ligand torsion block (any block whose name mentions Torsion).
+    """
+    return [fields for name, fields in catalog if 'Torsion' in name]
+
+
+def result_values(fields):
+    """
+    Return the numeric Result array of a block, or None if it is missing.
+    """
+    if not fields:
+        return None
+    values = fields.get('Result')
+    if not isinstance(values, np.ndarray) or not values.size:
+        return None
+    return values
+
+
+def residue_numbers(fields, catalog=()):
+    """
+    Return the residue numbers listed in ProteinResidues, taken from fields or,
+    failing that, from the first block of the catalog that has them.
+    """
+    residues = fields.get('ProteinResidues') if fields else None
+    if residues is None:
+        for _, block_fields in catalog:
+            if 'ProteinResidues' in block_fields:
+                residues = block_fields['ProteinResidues']
+                break
+    if not isinstance(residues, list):
+        return None
+    return np.array([int(number) for residue in residues for number in re.findall(r'\d+', str(residue))], dtype=np.int64)
@@ -0,0 +1,149 @@
+import numpy as np
+
+from desprofile import timed
+
+WINDOW_FACTOR = 5
+MIN_BLOCKS = 16
+BLOCK_FACTOR = 4  # Bootstrap blocks span this many correlation times
+N_BOOT = 1000
+CONFIDENCE = 0.95
+
+
+def autocorrelation(series):
+    """
+    Normalized autocorrelation function of every row of series (one time
+    series per row, or a single 1-D series), computed with one zero-padded FFT.
+    """
+    series = np.asarray(series, dtype=np.float64)
+    data = np.atleast_2d(series)
+    n = data.shape[1]
+    centered = data - data.mean(axis=1, keepdims=True)
+    size = 1 << int(np.ceil(np.log2(2 * n - 1))) if n > 1 else 1
+    spectrum = np.fft.rfft(centered, size)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum), size)[:, :n]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        acf = np.where(acov[:, :1] > 0, acov / acov[:, :1], 0.0)
+    acf[:, 0] = 1.0
+    return acf[0] if series.ndim == 1 else acf
+
+
+def integrated_time(acf, window_factor=WINDOW_FACTOR):
+    """
+    Integrated autocorrelation time, in frames, of every autocorrelation
+    function of acf, using Sokal's automatic window: the sum is cut at the
+    first lag M with M >= window_factor * tau(M).
+    """
+    acf = np.asarray(acf, dtype=np.float64)
+    data = np.atleast_2d(acf)
+    taus = 2 * np.cumsum(data, axis=1) - 1
+    window = np.arange(data.shape[1]) >= window_factor * taus
+    cut = np.where(window.any(axis=1), window.argmax(axis=1), data.shape[1] - 1)
+    tau = taus[np.arange(len(data)), cut]
+    return tau[0] if acf.ndim == 1 else tau
+
+
+def block_standard_errors(series):
+    """
+    Standard error of the mean of every row of series at each level of
+    Flyvbjerg-Petersen blocking (pairs of blocks averaged at every level).
+    Returns a (levels, rows) matrix and the number of blocks of each level.
+    """
+    data = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    errors, blocks = [], []
+    while data.shape[1] >= 2:
+        errors.append(np.sqrt(np.var(data, axis=1, ddof=1) / data.shape[1]))
+        blocks.append(data.shape[1])
+        pairs = data.shape[1] // 2
+        data = 0.5 * (data[:, 0:2 * pairs:2] + data[:, 1:2 * pairs:2])
+    return np.array(errors).reshape(len(errors), -1), np.array(blocks)
+
+
+def block_standard_error(series, min_blocks=MIN_BLOCKS):
+    """
+    Block-averaged standard error of the mean of every row of series: the
+    largest error over the blocking levels that keep at least min_blocks
+    blocks, which is where the correlated estimate plateaus.
+    """
+    errors, blocks = block_standard_errors(series)
+    if not len(blocks):
+        error = np.full(np.atleast_2d(series).shape[0], np.nan)
+    else:
+        usable = blocks >= min(min_blocks, blocks[0])
+        error = errors[usable].max(axis=0)
+    return error[0] if np.ndim(series) == 1 else error
+
+
+def circular_block_bootstrap(series, block_length, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0):
+    """
+    Circular block bootstrap of the mean of every row of series with blocks of
+    block_length frames. Blocks wrap around the end of the series, so all n
+    start positions are drawn and every frame carries the same weight: the
+    resampled means are centred on the sample mean, even for series that
+    drift (e.g. an RMSD ramping up from 0). The block means come from one
+    cumulative sum, and each resample averages ceil(n / block_length) of them.
+    Returns (standard error, lower, upper) arrays of the confidence interval.
+    """
+    data = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    n = data.shape[1]
+    block_length = int(min(max(block_length, 1), n))
+    wrapped = np.concatenate([data, data[:, :block_length - 1]], axis=1)
+    cumulative = np.concatenate([np.zeros((len(data), 1)), np.cumsum(wrapped, axis=1)], axis=1)
+    block_means = (cumulative[:, block_length:] - cumulative[:, :-block_length]) / block_length
+    blocks = -(-n // block_length)
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n, size=(n_boot, blocks))
+    step = max(1, 8_000_000 // max(len(data) * blocks, 1))  # Bound the gathered (rows, resamples, blocks) array
+    boot_means = np.concatenate([block_means[:, starts[i:i + step]].mean(axis=2) for i in range(0, n_boot, step)], axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.percentile(boot_means, [100 * alpha, 100 * (1 - alpha)], axis=1)
+    return boot_means.std(axis=1, ddof=1), low, high
+
+
+@timed('error_analysis')
+def error_analysis(series, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0):
+    """
+    Correlation-aware uncertainty of the mean of every row of a (replicas,
+    frames) matrix of equally long series: integrated autocorrelation time,
+    effective sample size, autocorrelation- and block-averaged standard errors,
+    and a circular block bootstrap interval whose blocks span BLOCK_FACTOR
+    correlation times. Rows sharing a block length are resampled together.
+    """
+    data = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    n = data.shape[1]
+    tau = np.maximum(integrated_time(autocorrelation(data)), 1.0)  # Anticorrelation is not credited
+    block_lengths = np.clip(np.ceil(BLOCK_FACTOR * tau).astype(np.int64), 1, n)
+    bootstrap_se, low, high = np.empty(len(data)), np.empty(len(data)), np.empty(len(data))
+    for block_length in np.unique(block_lengths):
+        rows = block_lengths == block_length
+        bootstrap_se[rows], low[rows], high[rows] = circular_block_bootstrap(data[rows], block_length, n_boot,
+                                                                           confidence, seed)
+    return {
+        'tau': tau,
+        'n_eff': n / tau,
+        'se_tau': data.std(axis=1, ddof=1) * np.sqrt(tau / n) if n > 1 else np.full(len(data), np.nan),
+        'se_block': block_standard_error(data),
+        'se_bootstrap': bootstrap_se,
+        'ci_low': low,
+        'ci_high': high,
+    }
+
+
+def error_metrics(values, confidence=CONFIDENCE):
+    """
+    error_analysis of a single series, keyed like calculate_metrics, or None
+    for series too short to analyse.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size < 4:
+        return None
+    analysis = {key: float(value[0]) for key, value in error_analysis(values, confidence=confidence).items()}
+    level = f"{100 * confidence:g}%"
+    return {
+        "Integrated Autocorrelation Time (frames)": analysis['tau'],
+        "Effective Sample Size": analysis['n_eff'],
+        "Standard Error of the Mean (autocorrelation)": analysis['se_tau'],
+        "Standard Error of the Mean (block averaging)": analysis['se_block'],
+        "Standard Error of the Mean (block bootstrap)": analysis['se_bootstrap'],
+        f"Mean {level} CI Lower (block bootstrap)": analysis['ci_low'],
+        f"Mean {level} CI Upper (block bootstrap)": analysis['ci_high'],
+    }
@@ -0,0 +1,117 @@
+import argparse
+import functools
+import json
+import sys
+
+from desbatch import (HOLO_OPTIONS, STRUCTURE_TYPES, add_batch_arguments, add_parallel_arguments, batch_entries, batch_files,
+                      is_batch, make_parent_dir)
+from desparallel import map_files
+from desprofile import configure
+
+
+def rmsd_metrics(entries, structure_type, holo_option, workers=None, chunksize=1, ensemble=None):
+    """
+    Return (name, metrics) pairs for the RMSD series of (file, name) entries,
+    plus one for the merged ensemble when ensemble names it. Files whose RMSD
+    cannot be extracted are reported and skipped.
+    """
+    from desprobaplot import calculate_metrics, extract_rmsd_values
+    from desstats import StreamingStats, merge_stats
+
+    extract = functools.partial(extract_rmsd_values, structure_type=structure_type, holo_option=holo_option)
+    results = map_files(extract, [file for file, _ in entries], workers, chunksize)
+    rows = []
+    series = []
+    for (file, name), rmsd_values in zip(entries, results):
+        metrics = calculate_metrics(rmsd_values)
+        if metrics:
+            rows.append((name, metrics))
+            series.append(rmsd_values)
+        else:
+            print(f"Failed to extract RMSD values from {file}. Skipping...", file=sys.stderr)
+    if ensemble and series:
+        rows.append((ensemble, calculate_metrics(merge_stats(StreamingStats().update(values) for values in series))))
+    return rows
+
+
+def write_rmsd_metrics(rows, metrics_path=None, as_json=False):
+    from desprobaplot import write_metrics_to_file
+
+    if metrics_path:
+        for name, metrics in rows:
+            write_metrics_to_file(metrics, name, metrics_path)
+    elif as_json:
+        for name, metrics in rows:
+            print(json.dumps({'name': name, **{key: float(value) for key, value in metrics.items()}}))
+    else:
+        for name, metrics in rows:
+            print(f"Metrics for {name}:")
+            for key, value in metrics.items():
+                print(f"{key}: {value}")
+            print()
+
+
+def mmgbsa_statistics(csv_files, output_path=None):
+    from desMMGBSA import analyze_csv_file, save_statistics_to_file
+
+    if output_path:
+        make_parent_dir(output_path)
+        open(output_path, 'w').close()
+    for csv_file in csv_files:
+        try:
+            statistics, compound_name = analyze_csv_file(csv_file)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"Failed to analyze {csv_file}: {e}. Skipping...", file=sys.stderr)
+            continue
+        if output_path:
+            save_statistics_to_file(statistics, csv_file, compound_name, output_path, mode='a')
+        else:
+            print(f"Statistics for {csv_file}:")
+            print(f"Compound Name: {compound_name}")
+            print(statistics.to_string(), end='\n\n')
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Compute RMSD metrics or MM-GBSA statistics without plotting; matplotlib is never imported.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rmsd = commands.add_parser('rmsd', help="Metrics of the RMSD series of .eaf files (as written by desboxplot.py and desprobaplot.py).")
+    group = add_batch_arguments(rmsd, kind='eaf')
+    group.add_argument('--structure', choices=STRUCTURE_TYPES, default='apo',
+                       help="Type of structure of every input (default: apo).")
+    group.add_argument('--holo', choices=HOLO_OPTIONS, default='protein',
+                       help="For holo structures: ligand fit by protein, ligand fit by ligand or the protein's backbone (default: protein).")
+    group.add_argument('--metrics', metavar='PATH',
+                       help="Append the metrics to this file instead of printing them.")
+    group.add_argument('--json', action='store_true',
+                       help="Print one JSON object per input instead of text.")
+    group.add_argument('--ensemble', metavar='NAME',
+                       help="Also report the metrics of all inputs merged into one ensemble under this name.")
+    add_parallel_arguments(group)
+
+    mmgbsa = commands.add_parser('mmgbsa', help="Statistics of Prime MM-GBSA CSV files (as written by desMMGBSA.py).")
+    group = add_batch_arguments(mmgbsa, names=False, kind='mmgbsa')
+    group.add_argument('--output', metavar='PATH',
+                       help="Write the statistics to this file instead of printing them.")
+
+    args = parser.parse_args(argv)
+    if args.command == 'rmsd' and not is_batch(args):
+        rmsd.error("--files, --manifest or --catalog is required")
+    if args.command == 'mmgbsa' and not is_batch(args):
+        mmgbsa.error("--files or --catalog is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if args.command == 'rmsd':
+        rows = rmsd_metrics(batch_entries(args), STRUCTURE_TYPES[args.structure], HOLO_OPTIONS[args.holo],
+                            args.workers, args.chunksize, args.ensemble)
+        write_rmsd_metrics(rows, args.metrics, args.json)
+    else:
+        mmgbsa_statistics(batch_files(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
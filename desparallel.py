@@ -0,0 +1,59 @@
+import os
+
+import desprofile
+
+
+def _call_safely(function, file_path):
+    try:
+        return function(file_path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _init_worker(profile, initializer, initargs):
+    if profile:
+        desprofile.enable_worker()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call_in_worker(function, file_path):
+    result, error = _call_safely(function, file_path)
+    return result, error, desprofile.collect() if desprofile.enabled() else None
+
+
+def map_files(function, file_paths, workers=None, chunksize=1, initializer=None, initargs=()):
+    """
+    Apply function to every file in a pool of worker processes and return the
+    results in input order. A file whose processing raises gets None as result
+    and a message, so one bad file does not abort the batch. function must be
+    picklable (a module-level function or a functools.partial of one).
+    workers defaults to the number of CPUs; with 1 worker nothing is spawned.
+    initializer(*initargs) runs once in every worker (or here, without workers).
+    When profiling is enabled, the workers' phases and counters are added to
+    this process's report.
+    """
+    file_paths = list(file_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(file_paths)))
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        outcomes = [_call_safely(function, file_path) for file_path in file_paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(desprofile.enabled(), initializer, initargs)) as executor:
+            outcomes = []
+            for result, error, measurements in executor.map(_call_in_worker, [function] * len(file_paths), file_paths,
+                                                            chunksize=max(1, chunksize)):
+                if measurements is not None:
+                    desprofile.merge(measurements)
+                outcomes.append((result, error))
+    results = []
+    for file_path, (result, error) in zip(file_paths, outcomes):
+        if error is not None:
+            print(f"Error processing {file_path}: {error}")
+        results.append(result)
+    return results
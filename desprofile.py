@@ -0,0 +1,206 @@
+import atexit
+import contextlib
+import csv
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ENV_REPORT = 'DESMOTOOLS_PROFILE'
+ENV_CPROFILE = 'DESMOTOOLS_CPROFILE'
+
+_state = {
+    'enabled': False,
+    'report_path': None,
+    'profiler': None,
+    'cprofile_path': None,
+    'started': None,
+    'phases': {},
+    'counters': {},
+    'stack': [],
+    'peak': 0,
+    'pid': None,
+}
+
+
+def enabled():
+    return _state['enabled']
+
+
+def enable(report_path=None, cprofile_path=None, trace_memory=True):
+    """
+    Start collecting phase timings, counters and peak memory (tracemalloc).
+    The report is written to report_path (.json or .csv) when the process
+    exits; cprofile_path additionally dumps cProfile statistics there.
+    """
+    if _state['enabled']:
+        return
+    _state.update(enabled=True, report_path=report_path, started=time.perf_counter(), pid=os.getpid())
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if cprofile_path:
+        import cProfile
+        _state['profiler'] = cProfile.Profile()
+        _state['cprofile_path'] = cprofile_path
+        _state['profiler'].enable()
+    atexit.register(_finish)
+
+
+def enable_worker(trace_memory=True):
+    """
+    Start collecting in a worker process of desparallel.map_files. Nothing is
+    written here: collect() hands the measurements to the parent, which adds
+    them to its own with merge().
+    """
+    if _state['profiler'] is not None:  # Inherited from a forked parent
+        _state['profiler'].disable()
+    _state.update(enabled=True, report_path=None, profiler=None, cprofile_path=None, started=time.perf_counter(),
+                  phases={}, counters={}, stack=[], peak=0, pid=None)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def collect():
+    """
+    Return the phases and counters recorded since the last call and reset them.
+    """
+    measurements = {'phases': _state['phases'], 'counters': _state['counters']}
+    _state.update(phases={}, counters={})
+    return measurements
+
+
+def merge(measurements):
+    """
+    Add the measurements of collect() from a worker process to this one's:
+    calls, seconds and counters are summed, peak memory is the largest.
+    """
+    for name, worker in measurements['phases'].items():
+        entry = _state['phases'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_mb': 0.0})
+        entry['calls'] += worker['calls']
+        entry['seconds'] += worker['seconds']
+        entry['peak_memory_mb'] = max(entry['peak_memory_mb'], worker['peak_memory_mb'])
+    for name, value in measurements['counters'].items():
+        _state['counters'][name] = _state['counters'].get(name, 0) + value
+
+
+def add_profile_arguments(parser):
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', metavar='PATH',
+                       help=f"Write a JSON or CSV report of the time, counters and peak memory of each phase (or set {ENV_REPORT}).")
+    group.add_argument('--cprofile', metavar='PATH',
+                       help=f"Also dump cProfile statistics to this file (or set {ENV_CPROFILE}).")
+    return group
+
+
+def configure(args):
+    """
+    Enable profiling if requested on the command line.
+    """
+    if getattr(args, 'profile', None) or getattr(args, 'cprofile', None):
+        enable(args.profile, args.cprofile)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Time a block of code and record its peak traced memory under name.
+    Costs nothing when profiling is disabled.
+    """
+    if not _state['enabled']:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        _state['peak'] = max(_state['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    frame = {'peak': 0}
+    _state['stack'].append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _state['stack'].pop()
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1]) if tracing else 0
+        for parent in _state['stack']:
+            parent['peak'] = max(parent['peak'], peak)
+        _state['peak'] = max(_state['peak'], peak)
+        entry = _state['phases'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_mb': 0.0})
+        entry['calls'] += 1
+        entry['seconds'] += elapsed
+        entry['peak_memory_mb'] = max(entry['peak_memory_mb'], peak / 1024 ** 2)
+
+
+def timed(name=None):
+    """
+    Decorator running the whole function inside phase(name).
+    """
+    def decorator(function):
+        phase_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return function(*args, **kwargs)
+            with phase(phase_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    if _state['enabled']:
+        _state['counters'][name] = _state['counters'].get(name, 0) + amount
+
+
+def report():
+    """
+    Return the collected measurements as a dict. Phases run in the workers of
+    desparallel.map_files are included, their seconds summed over workers.
+    """
+    peak = _state['peak']
+    if tracemalloc.is_tracing():
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    return {
+        'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+        'wall_s': time.perf_counter() - _state['started'] if _state['started'] is not None else 0.0,
+        'peak_memory_mb': peak / 1024 ** 2,
+        'phases': dict(_state['phases']),
+        'counters': dict(_state['counters']),
+    }
+
+
+def write_report(report_path):
+    data = report()
+    if os.path.dirname(report_path):
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    if report_path.endswith('.csv'):
+        with open(report_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['kind', 'name', 'calls', 'seconds', 'peak_memory_mb', 'value'])
+            writer.writerow(['run', data['script'], '', data['wall_s'], data['peak_memory_mb'], ''])
+            for name, entry in data['phases'].items():
+                writer.writerow(['phase', name, entry['calls'], entry['seconds'], entry['peak_memory_mb'], ''])
+            for name, value in data['counters'].items():
+                writer.writerow(['counter', name, '', '', '', value])
+    else:
+        with open(report_path, 'w') as file:
+            json.dump(data, file, indent=1)
+
+
+def _finish():
+    if os.getpid() != _state['pid']:  # Forked worker
+        return
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+        _state['profiler'].dump_stats(_state['cprofile_path'])
+    if _state['report_path']:
+        write_report(_state['report_path'])
+
+
+if os.environ.get(ENV_REPORT) or os.environ.get(ENV_CPROFILE):
+    import multiprocessing
+    if multiprocessing.parent_process() is None:  # Worker processes do not write reports
+        enable(os.environ.get(ENV_REPORT) or None, os.environ.get(ENV_CPROFILE) or None)
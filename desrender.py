@@ -0,0 +1,243 @@
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from desbatch import HOLO_OPTIONS, STRUCTURE_TYPES, default_name, finish_figure, use_headless_backend
+from desparallel import map_files
+from desprofile import add_profile_arguments, configure, phase, timed
+
+FIGURE_TYPES = ['boxplot', 'pdf', 'rmsf', 'rg']
+PANEL_SIZE = (10, 6)
+
+_shared = {}
+
+
+def _input(entry, base_dir):
+    if isinstance(entry, str):
+        file, name = entry, None
+    elif isinstance(entry, dict):
+        file, name = entry['file'], entry.get('name')
+    else:
+        file, name = entry[0], entry[1] if len(entry) > 1 else None
+    file = os.path.join(base_dir, file)
+    return file, name or default_name(file)
+
+
+def _panel(panel, base_dir):
+    if panel.get('type') not in FIGURE_TYPES:
+        raise ValueError(f"Unknown figure type {panel.get('type')!r}, expected one of {', '.join(FIGURE_TYPES)}")
+    return dict(panel, inputs=[_input(entry, base_dir) for entry in panel.get('inputs', [])],
+                structure=panel.get('structure', 'apo'), holo=panel.get('holo', 'protein'), unit=panel.get('unit', 1))
+
+
+def read_specs(spec_path):
+    """
+    Read a JSON list of figure specs. A figure has an output path (without
+    extension), optional formats, title, figsize and grid ([rows, columns]),
+    and a list of panels; a single-panel figure may give the panel keys
+    directly. A panel has a type (boxplot, pdf, rmsf or rg), inputs (paths,
+    [path, name] pairs or {"file", "name"} objects, relative to the spec file)
+    and, depending on the type, structure/holo or unit.
+    """
+    base_dir = os.path.dirname(spec_path)
+    with open(spec_path) as file:
+        specs = json.load(file)
+    if isinstance(specs, dict):
+        specs = specs['figures']
+    figures = []
+    for spec in specs:
+        panels = spec['panels'] if 'panels' in spec else [spec]
+        figures.append(dict(spec, output=os.path.join(base_dir, spec['output']), formats=spec.get('formats', ['png']),
+                            panels=[_panel(panel, base_dir) for panel in panels]))
+    return figures
+
+
+def data_key(panel, file):
+    """
+    Key of the data a panel needs from file; panels sharing a key share the
+    parsed arrays.
+    """
+    if panel['type'] in ('boxplot', 'pdf'):
+        return ('rmsd', file, panel['structure'], panel['holo'])
+    return (panel['type'], file)
+
+
+def load_data(key):
+    """
+    Parse the arrays behind a data key, as a tuple, or None if they cannot be
+    extracted.
+    """
+    kind, file = key[0], key[1]
+    if kind == 'rmsd':
+        from desprobaplot import extract_rmsd_values
+        values = extract_rmsd_values(file, STRUCTURE_TYPES[key[2]], HOLO_OPTIONS[key[3]])
+        return None if values is None else (values,)
+    if kind == 'rmsf':
+        from desrmsf import extract_rmsf_profile
+        return extract_rmsf_profile(file)
+    from desRg_apo import extract_rg_values
+    time_values, rg_values = extract_rg_values(file)
+    return None if time_values is None else (time_values, rg_values)
+
+
+def share_arrays(data):
+    """
+    Copy every array of data (key -> tuple of arrays or None) into one shared
+    memory block. Returns the block and an index mapping every key to the
+    (offset, shape, dtype) of its arrays, from which workers rebuild views.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    index = {}
+    size = 0
+    for key, arrays in data.items():
+        if arrays is None:
+            continue
+        index[key] = []
+        for array in arrays:
+            array = np.asarray(array)
+            index[key].append((size, array.shape, array.dtype.str))
+            size += -(-array.nbytes // 8) * 8  # Keep every array 8-byte aligned
+    memory = SharedMemory(create=True, size=max(size, 1))
+    for key, entries in index.items():
+        for array, (offset, shape, dtype) in zip(data[key], entries):
+            np.ndarray(shape, dtype, buffer=memory.buf, offset=offset)[...] = array
+    return memory, index
+
+
+def _attach(name, index, specs):
+    from multiprocessing.shared_memory import SharedMemory
+
+    use_headless_backend()
+    if _shared.get('name') != name:
+        _shared.update(name=name, memory=SharedMemory(name=name), index=index)
+    _shared['specs'] = {spec['output']: spec for spec in specs}
+
+
+def shared_data(key):
+    """
+    Read-only views of the arrays of key in the shared memory block, or None.
+    """
+    entries = _shared['index'].get(key)
+    if entries is None:
+        return None
+    views = tuple(np.ndarray(shape, dtype, buffer=_shared['memory'].buf, offset=offset)
+                  for offset, shape, dtype in entries)
+    for view in views:
+        view.flags.writeable = False
+    return views
+
+
+def draw_panel(panel, ax):
+    files = [file for file, _ in panel['inputs']]
+    names = [name for _, name in panel['inputs']]
+    data = [shared_data(data_key(panel, file)) for file in files]
+    if panel['type'] == 'rmsf':
+        from desrmsf import plot_rmsf_residue
+        plot_rmsf_residue(files, names, ax=ax, profiles=data)
+    elif panel['type'] == 'rg':
+        from desRg_apo import plot_rg_time
+        plot_rg_time(files, names, panel['unit'], ax=ax, series=[arrays or (None, None) for arrays in data])
+    else:
+        for file, arrays in zip(files, data):
+            if arrays is None:
+                print(f"Failed to extract RMSD values from {file}. Skipping...")
+        values = [arrays[0] for arrays in data if arrays is not None]
+        names = [name for name, arrays in zip(names, data) if arrays is not None]
+        if not values:
+            ax.set_visible(False)
+        elif panel['type'] == 'boxplot':
+            from desboxplot import plot_boxplot
+            plot_boxplot(values, names, ax=ax)
+        else:
+            from desprobaplot import plot_pdf
+            plot_pdf(values, [STRUCTURE_TYPES[panel['structure']]] * len(values), names, ax=ax)
+    if panel.get('title'):
+        ax.set_title(panel['title'])
+
+
+def grid_shape(spec):
+    """
+    Rows and columns of a figure: the spec's grid, or the squarest grid
+    holding all its panels.
+    """
+    if spec.get('grid'):
+        return tuple(spec['grid'])
+    columns = math.ceil(math.sqrt(len(spec['panels'])))
+    return math.ceil(len(spec['panels']) / columns), columns
+
+
+@timed('render')
+def render_figure(spec):
+    """
+    Draw every panel of a figure spec on its grid and save it. Runs in the
+    rendering workers, which read the parsed data from shared memory.
+    """
+    import matplotlib.pyplot as plt
+
+    rows, columns = grid_shape(spec)
+    if rows * columns < len(spec['panels']):
+        raise ValueError(f"A {rows}x{columns} grid cannot hold {len(spec['panels'])} panels")
+    figsize = spec.get('figsize') or (PANEL_SIZE[0] * columns, PANEL_SIZE[1] * rows)
+    figure, axes = plt.subplots(rows, columns, figsize=figsize, squeeze=False)
+    try:
+        for panel, ax in zip(spec['panels'], axes.flat):
+            draw_panel(panel, ax)
+    except BaseException:
+        plt.close(figure)  # Workers render many figures, do not leave this one open
+        raise
+    for ax in axes.flat[len(spec['panels']):]:
+        ax.set_visible(False)
+    if spec.get('title'):
+        figure.suptitle(spec['title'])
+    figure.tight_layout()
+    finish_figure(spec['output'], spec['formats'])
+    return spec['output']
+
+
+def _render_output(output):
+    return render_figure(_shared['specs'][output])
+
+
+def render_all(specs, workers=None, chunksize=1):
+    """
+    Parse the inputs of every figure once, in parallel, place them in shared
+    memory and render the figures concurrently in Agg worker processes.
+    Returns the output path of every figure, None for those that failed.
+    """
+    keys = list(dict.fromkeys(data_key(panel, file) for spec in specs for panel in spec['panels']
+                              for file, _ in panel['inputs']))
+    with phase('load'):
+        data = dict(zip(keys, map_files(load_data, keys, workers, chunksize)))
+    memory, index = share_arrays(data)
+    try:
+        return map_files(_render_output, [spec['output'] for spec in specs], workers, chunksize, _attach,
+                         (memory.name, index, specs))
+    finally:
+        if _shared.pop('name', None) == memory.name:  # Rendered in this process
+            del _shared['index'], _shared['specs']
+            _shared.pop('memory').close()
+        memory.close()
+        memory.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render many figures (boxplots, PDFs, RMSF and Rg plots, or grids of them) described in a JSON spec file, in parallel.")
+    parser.add_argument('specs', help="JSON file listing the figures (see read_specs).")
+    parser.add_argument('--workers', type=int, default=None, metavar='N',
+                        help="Number of worker processes parsing the inputs and rendering (default: one per CPU).")
+    parser.add_argument('--chunksize', type=int, default=1, metavar='N',
+                        help="Number of inputs or figures handed to a worker at a time (default: 1).")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    configure(args)
+    specs = read_specs(args.specs)
+    outputs = render_all(specs, args.workers, args.chunksize)
+    print(f"Rendered {sum(output is not None for output in outputs)} of {len(specs)} figures.")
+
+
+if __name__ == "__main__":
+    main()
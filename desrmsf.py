@@ -1,11 +1,21 @@
+import argparse
+import csv
 import os
-import re
-import matplotlib.pyplot as plt
-import seaborn as sns
+import warnings
 import numpy as np
+from desbatch import (add_batch_arguments, add_downsample_argument, add_figure_arguments, add_parallel_arguments, batch_entries, finish_figure,
+                      is_batch, make_parent_dir, use_headless_backend)
+from desdensity import ENVELOPES, X_BINS, plot_density
+from desdownsample import plot_line
+from desparallel import map_files
+from desprofile import configure, timed
+from desstats import benjamini_hochberg, welch_test
+from deseaf import EafSyntaxError, load_block, load_catalog, rmsf_block, result_values, residue_numbers
+from descompress import has_suffix
 
+@timed('list_files')
 def list_eaf_files():
-    eaf_files = [file for file in os.listdir() if file.endswith(".eaf")]
+    eaf_files = [file for file in os.listdir() if has_suffix(file, ".eaf")]
     return eaf_files
 
 def select_files(eaf_files):
@@ -33,60 +43,403 @@ def enter_curve_names(num_curves):
         print("Invalid input. Please enter comma-separated names.")
         return None
 
-def extract_rmsf_values(file_path):
-    first_term = '{RMSF = {'
-    second_term = 'FitBy = "(((protein) and backbone) and not (atom.ele H)'
-
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        found_first_term = False
-        found_second_term = False
-        rmsf_values = []
-        
-        for line in lines:
-            if first_term in line:
-                found_first_term = True
-            elif found_first_term and second_term in line:
-                found_second_term = True
-            elif found_first_term and found_second_term and "Result =" in line:
-                try:
-                    values_str = re.search(r'\[(.*?)\]', line).group(1)
-                    rmsf_values = [float(val) for val in values_str.split()]
-                    return rmsf_values
-                except (IndexError, ValueError, AttributeError):
-                    return None
-
-    return None
-
-def extract_residue_numbers(file_path):
-    keyword = 'ProteinResidues ='
-    with open(file_path, 'r') as file:
-        for line in file:
-            if keyword in line:
-                try:
-                    residue_numbers = re.findall(r'\d+', line)
-                    return [int(number) for number in residue_numbers]
-                except ValueError:
-                    return None
-    return None
-
-def plot_rmsf_residue(selected_files, curve_names, time_step=0.1):
-    plt.figure(figsize=(10, 6))  # Adjust figure size if needed
-    colors = sns.color_palette("hsv", len(selected_files))  # Generate a list of colors
-    for i, selected_file in enumerate(selected_files):
-        rmsf_values = extract_rmsf_values(selected_file)
-        residue_numbers = extract_residue_numbers(selected_file)
-        if rmsf_values and residue_numbers:
-            plt.plot(residue_numbers, rmsf_values, label=curve_names[i], color=colors[i])
+def extract_rmsf_values(file_path, catalog=None):
+    if catalog is None:
+        return result_values(load_block(file_path, rmsf_block))
+    return result_values(rmsf_block(catalog))
+
+def extract_residue_numbers(file_path, catalog=None):
+    if catalog is None:
+        catalog = load_catalog(file_path, ['RMSF'])
+    return residue_numbers(rmsf_block(catalog), catalog)
+
+def extract_rmsf_profile(file_path):
+    """
+    Read a file once and return its (residue numbers, RMSF values), or None.
+    """
+    try:
+        fields = load_block(file_path, rmsf_block)
+        catalog = [] if fields is None or 'ProteinResidues' in fields else load_catalog(file_path, ['RMSF'])
+    except EafSyntaxError:
+        return None
+    rmsf_values = result_values(fields)
+    residues = residue_numbers(fields, catalog)
+    if rmsf_values is None or residues is None or len(residues) != len(rmsf_values):
+        return None
+    return residues, rmsf_values
+
+def _occurrences(residues):
+    """
+    Rank of every residue number among the equal numbers before it, so that
+    chains restarting their numbering still give distinct join keys.
+    """
+    order = np.argsort(residues, kind='stable')
+    sorted_residues = residues[order]
+    starts = np.flatnonzero(np.r_[True, sorted_residues[1:] != sorted_residues[:-1]])
+    occurrences = np.empty(len(residues), dtype=np.int64)
+    occurrences[order] = np.arange(len(residues)) - np.repeat(starts, np.diff(np.r_[starts, len(residues)]))
+    return occurrences
+
+def align_profiles(profiles):
+    """
+    Join the (residue numbers, RMSF values) profiles of several replicas on
+    their residue numbers. Returns the sorted union of residue numbers and a
+    (replicas, residues) matrix holding NaN where a replica lacks a residue.
+    """
+    keys = [np.column_stack([residues, _occurrences(residues)]) for residues, _ in profiles]
+    union, columns = np.unique(np.concatenate(keys), axis=0, return_inverse=True)
+    rows = np.repeat(np.arange(len(profiles)), [len(key) for key in keys])
+    matrix = np.full((len(profiles), len(union)), np.nan)
+    matrix[rows, columns.ravel()] = np.concatenate([rmsf_values for _, rmsf_values in profiles])
+    return union[:, 0], matrix
+
+@timed('statistics')
+def ensemble_statistics(matrix, confidence=0.95, n_boot=1000, seed=0):
+    """
+    Per-residue replica count, mean, standard deviation and bootstrap
+    confidence interval of the mean of a (replicas, residues) RMSF matrix,
+    ignoring NaN. Every bootstrap resample of the replicas is drawn as a row of
+    multinomial weights, so all resamples are averaged in one matrix product.
+    """
+    present = ~np.isnan(matrix)
+    values = np.where(present, matrix, 0.0)
+    count = present.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=0) / count
+        sd = np.sqrt(np.where(present, (matrix - mean) ** 2, 0.0).sum(axis=0) / (count - 1))
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(len(matrix), np.full(len(matrix), 1 / len(matrix)), size=n_boot).astype(np.float64)
+        boot_means = (weights @ values) / (weights @ present)
+    alpha = (1 - confidence) / 2
+    boot_means.sort(axis=0)  # NaN (resamples missing a residue) sort last
+    valid = np.sum(~np.isnan(boot_means), axis=0)
+    columns = np.arange(boot_means.shape[1])
+    low = boot_means[np.clip(np.floor(alpha * (valid - 1)).astype(np.int64), 0, None), columns]
+    high = boot_means[np.clip(np.ceil((1 - alpha) * (valid - 1)).astype(np.int64), 0, None), columns]
+    return {'count': count, 'mean': mean, 'sd': np.where(count > 1, sd, 0.0), 'ci_low': low, 'ci_high': high}
+
+def export_ensemble_statistics(file_path, residues, statistics_list, names):
+    """
+    Write the per-residue statistics of every ensemble to one long-format CSV.
+    """
+    make_parent_dir(file_path)
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['ensemble', 'residue', 'replicas', 'mean', 'sd', 'ci_low', 'ci_high'])
+        for name, ensemble_residues, statistics in zip(names, residues, statistics_list):
+            for row in zip(ensemble_residues, statistics['count'], statistics['mean'], statistics['sd'],
+                           statistics['ci_low'], statistics['ci_high']):
+                writer.writerow([name, int(row[0]), int(row[1])] + [repr(float(value)) for value in row[2:]])
+
+@timed('render')
+def plot_rmsf_ensemble(groups, names, band='ci', confidence=0.95, n_boot=1000, output=None, formats=("png",),
+                       workers=None, chunksize=1, statistics_path=None):
+    """
+    Plot the mean RMSF of every group of replica files with a band showing
+    either the bootstrap confidence interval of the mean ('ci') or one standard
+    deviation ('sd').
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    files = [file for group in groups for file in group]
+    profiles = dict(zip(files, map_files(extract_rmsf_profile, files, workers, chunksize)))
+    plt.figure(figsize=(10, 6))
+    colors = sns.color_palette("hsv", len(groups))
+    residues_list, statistics_list, plotted = [], [], []
+    for i, (group, name) in enumerate(zip(groups, names)):
+        for file in group:
+            if profiles[file] is None:
+                print(f"Failed to extract RMSF values or residue numbers from {file}. Skipping...")
+        replicas = [profiles[file] for file in group if profiles[file] is not None]
+        if not replicas:
+            continue
+        residues, matrix = align_profiles(replicas)
+        statistics = ensemble_statistics(matrix, confidence, n_boot)
+        if band == 'sd':
+            low, high = statistics['mean'] - statistics['sd'], statistics['mean'] + statistics['sd']
         else:
-            print(f"Failed to extract RMSF values or residue numbers from {selected_file}. Skipping...")
+            low, high = statistics['ci_low'], statistics['ci_high']
+        plt.plot(residues, statistics['mean'], label=f"{name} (n={len(replicas)})", color=colors[i])
+        plt.fill_between(residues, low, high, color=colors[i], alpha=0.3, linewidth=0)
+        residues_list.append(residues)
+        statistics_list.append(statistics)
+        plotted.append(name)
+    if statistics_path and plotted:
+        export_ensemble_statistics(statistics_path, residues_list, statistics_list, plotted)
     plt.xlabel('Residue Number')
     plt.ylabel('RMSF (Angstrom)')
     plt.title('RMSF vs Residue Number')
     plt.legend()
-    plt.show()
+    finish_figure(output, formats)
+
+def group_statistics(matrix, groups, n_groups):
+    """
+    Per-group replica count, mean and sample variance of every residue of a
+    (replicas, residues) RMSF matrix, ignoring NaN, as (groups, residues)
+    matrices. groups gives the group of every row; all groups are reduced
+    together with one-hot matrix products.
+    """
+    present = ~np.isnan(matrix)
+    membership = np.zeros((n_groups, len(matrix)))
+    membership[groups, np.arange(len(matrix))] = 1
+    count = membership @ present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (membership @ np.where(present, matrix, 0.0)) / count
+        deviations = np.where(present, matrix - mean[groups], 0.0)
+        variance = (membership @ deviations ** 2) / (count - 1)
+    return count, mean, variance
+
+@timed('statistics')
+def differential_rmsf(reference, systems):
+    """
+    Compare the RMSF of every system with a reference (e.g. holo runs with
+    the apo run). reference is a list of replica profiles (residue numbers,
+    RMSF values) and systems a list of such lists. All profiles are joined on
+    their residue numbers at once (see align_profiles), then every system is
+    tested against the reference residue by residue with Welch's t-test, and
+    the p-values of each system are adjusted with Benjamini-Hochberg.
+    Returns the residue numbers and a dict of (systems, residues) matrices.
+    """
+    profiles = list(reference) + [profile for replicas in systems for profile in replicas]
+    groups = np.repeat(np.arange(len(systems) + 1), [len(reference)] + [len(replicas) for replicas in systems])
+    residues, matrix = align_profiles(profiles)
+    count, mean, variance = group_statistics(matrix, groups, len(systems) + 1)
+    delta, t, df, p = welch_test(mean[:1], variance[:1], count[:1], mean[1:], variance[1:], count[1:])
+    return residues, {'reference_replicas': np.broadcast_to(count[:1], delta.shape), 'replicas': count[1:],
+                      'reference_mean': np.broadcast_to(mean[:1], delta.shape), 'mean': mean[1:], 'delta': delta,
+                      't': t, 'df': df, 'p': p, 'q': benjamini_hochberg(p)}
+
+def rank_differences(residues, differences, names, top=None):
+    """
+    Rows of (system, rank, residue, statistics...) with the residues of every
+    system ranked from the most to the least perturbed (largest |dRMSF|),
+    keeping the top ones when top is given. Residues missing from either side
+    are left out.
+    """
+    keys = ['reference_replicas', 'replicas', 'reference_mean', 'mean', 'delta', 't', 'df', 'p', 'q']
+    rows = []
+    for i, name in enumerate(names):
+        delta = differences['delta'][i]
+        order = np.argsort(-np.abs(np.where(np.isnan(delta), -np.inf, delta)), kind='stable')
+        order = order[~np.isnan(delta[order])][:top]
+        for rank, column in enumerate(order, 1):
+            rows.append([name, rank, int(residues[column])] + [differences[key][i, column] for key in keys])
+    return rows
+
+def screen_summary(differences, names, alpha=0.05):
+    """
+    One row per system: the number of residues with q < alpha, the mean and
+    the largest |dRMSF|, sorted from the most to the least perturbed system.
+    """
+    significant = np.sum(differences['q'] < alpha, axis=1)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Systems sharing no residue with the reference
+        magnitude = np.abs(differences['delta'])
+        mean, largest = np.nanmean(magnitude, axis=1), np.nanmax(magnitude, axis=1)
+    order = np.lexsort((-np.nan_to_num(mean), -significant))
+    return [(names[i], int(significant[i]), mean[i], largest[i]) for i in order]
+
+def export_differences(file_path, rows):
+    make_parent_dir(file_path)
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['system', 'rank', 'residue', 'reference_replicas', 'replicas', 'reference_mean', 'mean',
+                         'delta', 't', 'df', 'p', 'q'])
+        for row in rows:
+            writer.writerow(row[:3] + [int(row[3]), int(row[4])] + [repr(float(value)) for value in row[5:]])
+
+@timed('render')
+def plot_differential_rmsf(residues, differences, names, alpha=0.05, output=None, formats=("png",), max_curves=12):
+    """
+    Plot the dRMSF of every system against the reference, marking the
+    residues with q < alpha. Beyond max_curves systems, draw a systems x
+    residues heatmap instead.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    delta = differences['delta']
+    if len(names) > max_curves:
+        plt.figure(figsize=(12, max(4, min(0.12 * len(names), 16))))
+        limit = np.nanmax(np.abs(delta)) if np.isfinite(delta).any() else 1
+        image = plt.imshow(np.ma.masked_invalid(delta), aspect='auto', cmap='RdBu_r', vmin=-limit, vmax=limit,
+                           interpolation='nearest')
+        plt.colorbar(image, label='dRMSF (Angstrom)')
+        ticks = np.linspace(0, len(residues) - 1, min(len(residues), 10)).astype(int)  # Columns, as residues may have gaps
+        plt.xticks(ticks, residues[ticks])
+        if len(names) <= 100:
+            plt.yticks(range(len(names)), names, fontsize=max(4, min(8, 600 / len(names))))
+        plt.ylabel('System')
+        plt.title('RMSF difference to the reference')
+    else:
+        plt.figure(figsize=(10, 6))
+        colors = sns.color_palette("hsv", len(names))
+        for i, name in enumerate(names):
+            plt.plot(residues, delta[i], label=name, color=colors[i])
+            significant = differences['q'][i] < alpha
+            plt.scatter(residues[significant], delta[i][significant], color=colors[i], s=12, zorder=3)
+        plt.axhline(0, color='black', linewidth=0.8)
+        plt.ylabel('dRMSF (Angstrom)')
+        plt.title(f'RMSF difference to the reference (markers: q < {alpha:g})')
+        plt.legend()
+    plt.xlabel('Residue Number')
+    finish_figure(output, formats)
+
+def compare_to_reference(groups, names, reference, alpha=0.05, top=10, output=None, formats=("png",), workers=None,
+                         chunksize=1, differences_path=None):
+    """
+    Compare every group of replica files with the group named reference:
+    print the most perturbed residues of each system and a screening summary,
+    export the ranked residues of every system and plot the differences.
+    """
+    if reference not in names:
+        print(f"No inputs named {reference}.")
+        return
+    files = [file for group in groups for file in group]
+    profiles = dict(zip(files, map_files(extract_rmsf_profile, files, workers, chunksize)))
+    for file in files:
+        if profiles[file] is None:
+            print(f"Failed to extract RMSF values or residue numbers from {file}. Skipping...")
+    replica_sets = [[profiles[file] for file in group if profiles[file] is not None] for group in groups]
+    reference_set = replica_sets[names.index(reference)]
+    systems = [(name, replicas) for name, replicas in zip(names, replica_sets) if name != reference and replicas]
+    if not reference_set or not systems:
+        print("Nothing to compare.")
+        return
+    system_names = [name for name, _ in systems]
+    residues, differences = differential_rmsf(reference_set, [replicas for _, replicas in systems])
+    for name, rank, residue, *values in rank_differences(residues, differences, system_names, top):
+        if rank == 1:
+            print(f"\nMost perturbed residues of {name} vs {reference}:")
+        print(f"{rank:4d}  residue {residue:5d}  dRMSF {values[4]:+.3f}  p {values[7]:.3g}  q {values[8]:.3g}")
+    print(f"\n{'System':30s} {'q < ' + format(alpha, 'g'):>10s} {'mean |dRMSF|':>13s} {'max |dRMSF|':>12s}")
+    for name, significant, mean, largest in screen_summary(differences, system_names, alpha):
+        print(f"{name:30s} {significant:10d} {mean:13.3f} {largest:12.3f}")
+    if differences_path:
+        export_differences(differences_path, rank_differences(residues, differences, system_names))
+        print(f"Differences saved to {differences_path}")
+    plot_differential_rmsf(residues, differences, system_names, alpha, output, formats)
+
+def plot_rmsf_density(selected_files, envelopes=ENVELOPES, output=None, formats=("png",), workers=None, chunksize=1,
+                      ax=None, profiles=None):
+    """
+    Draw the RMSF profiles of many files as one residue-by-RMSF density image,
+    with one column per residue, and percentile envelopes.
+    """
+    import matplotlib.pyplot as plt
+    if profiles is None:
+        profiles = map_files(extract_rmsf_profile, selected_files, workers, chunksize)
+    for selected_file, profile in zip(selected_files, profiles):
+        if profile is None:
+            print(f"Failed to extract RMSF values or residue numbers from {selected_file}. Skipping...")
+    profiles = [profile for profile in profiles if profile is not None]
+    if not profiles:
+        print("No RMSF profiles to plot.")
+        return
+    if ax is None:
+        plt.figure(figsize=(10, 6))
+    first = min(int(residues.min()) for residues, _ in profiles)
+    last = max(int(residues.max()) for residues, _ in profiles)
+    plot_density(profiles, 'Residue Number', 'RMSF (Angstrom)', 'RMSF vs Residue Number', envelopes,
+                 x_bins=min(last - first + 1, X_BINS), x_range=(first - 0.5, last + 0.5), ax=ax,
+                 density_label='Fraction of profiles')
+    if ax is None:
+        finish_figure(output, formats)
+
+def group_entries(entries):
+    """
+    Group (file, name) entries by name, keeping the order in which the names
+    first appear.
+    """
+    groups = {}
+    for file, name in entries:
+        groups.setdefault(name, []).append(file)
+    return list(groups.values()), list(groups)
+
+@timed('render')
+def plot_rmsf_residue(selected_files, curve_names, time_step=0.1, output=None, formats=("png",), workers=None, chunksize=1,
+                      ax=None, profiles=None, downsample='minmax'):
+    """
+    Plot the RMSF profile of every file. Pass ax to draw into a panel of a
+    larger figure, and profiles to reuse (residues, RMSF) pairs already read.
+    Profiles longer than the axes are wide are downsampled (see desdownsample).
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if ax is None:
+        plt.figure(figsize=(10, 6))  # Adjust figure size if needed
+    axes = ax if ax is not None else plt.gca()
+    colors = sns.color_palette("hsv", len(selected_files))  # Generate a list of colors
+    if profiles is None:
+        profiles = map_files(extract_rmsf_profile, selected_files, workers, chunksize)  # Files are read in parallel
+    for i, (selected_file, profile) in enumerate(zip(selected_files, profiles)):
+        if profile is not None:
+            residues, rmsf_values = profile
+            plot_line(axes, residues, rmsf_values, downsample, label=curve_names[i], color=colors[i])
+        else:
+            print(f"Failed to extract RMSF values or residue numbers from {selected_file}. Skipping...")
+    axes.set_xlabel('Residue Number')
+    axes.set_ylabel('RMSF (Angstrom)')
+    axes.set_title('RMSF vs Residue Number')
+    axes.legend()
+    if ax is None:
+        finish_figure(output, formats)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Plot RMSF per residue from Desmond .eaf files. Without batch options, the files are chosen interactively.")
+    group = add_batch_arguments(parser, kind='eaf')
+    group.add_argument('--ensemble', action='store_true',
+                       help="Treat inputs sharing a name (--names or manifest) as replicas of one system and plot their mean RMSF with a band.")
+    group.add_argument('--aggregate', action='store_true',
+                       help="Draw all profiles as one residue-by-RMSF density image, for overlays of many replicas.")
+    group.add_argument('--envelopes', nargs='*', type=float, default=list(ENVELOPES), metavar='PERCENTILE',
+                       help="Percentile curves drawn over the density image (default: 5 50 95; none without values).")
+    group.add_argument('--band', choices=['ci', 'sd'], default='ci',
+                       help="Band of the ensemble plot: bootstrap confidence interval of the mean or one standard deviation (default: ci).")
+    group.add_argument('--confidence', type=float, default=0.95, metavar='LEVEL',
+                       help="Confidence level of the bootstrap interval (default: 0.95).")
+    group.add_argument('--bootstrap', type=int, default=1000, metavar='N',
+                       help="Number of bootstrap resamples of the replicas (default: 1000).")
+    group.add_argument('--statistics', metavar='CSV',
+                       help="Also export the per-residue ensemble statistics to this CSV file.")
+    group.add_argument('--reference', metavar='NAME',
+                       help="Compare every other group of replicas (inputs sharing a name) with the group NAME, e.g. the apo runs: "
+                            "dRMSF, Welch t-test and Benjamini-Hochberg q-value per residue, ranked.")
+    group.add_argument('--differences', metavar='CSV',
+                       help="With --reference, export every residue of every system, ranked, to this CSV file.")
+    group.add_argument('--alpha', type=float, default=0.05, metavar='LEVEL',
+                       help="With --reference, q-value below which a residue counts as significantly perturbed (default: 0.05).")
+    group.add_argument('--top', type=int, default=10, metavar='N',
+                       help="With --reference, number of most perturbed residues printed per system (default: 10).")
+    add_parallel_arguments(group)
+    add_downsample_argument(group)
+    add_figure_arguments(group, 'rmsf')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if is_batch(args):
+        use_headless_backend()
+        entries = batch_entries(args)
+        if entries and args.reference:
+            groups, names = group_entries(entries)
+            compare_to_reference(groups, names, args.reference, args.alpha, args.top, args.output, args.formats,
+                                 args.workers, args.chunksize, args.differences)
+        elif entries and args.ensemble:
+            groups, names = group_entries(entries)
+            plot_rmsf_ensemble(groups, names, args.band, args.confidence, args.bootstrap, args.output, args.formats,
+                               args.workers, args.chunksize, args.statistics)
+        elif entries and args.aggregate:
+            plot_rmsf_density([file for file, _ in entries], args.envelopes, args.output, args.formats,
+                              args.workers, args.chunksize)
+        elif entries:
+            selected_files, curve_names = zip(*entries)
+            plot_rmsf_residue(list(selected_files), list(curve_names), output=args.output, formats=args.formats,
+                              workers=args.workers, chunksize=args.chunksize, downsample=args.downsample)
+        else:
+            print("No .eaf files matched.")
+        return
 
-def main():
     eaf_files = list_eaf_files()
     if not eaf_files:
         print("No .eaf files found in the directory.")
@@ -104,6 +457,5 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-print("\nThank you byebye!\n")
+    print("\nThank you byebye!\n")
 
@@ -1,35 +1,133 @@
+import argparse
+import functools
 import os
 import re
+import tempfile
+from desbatch import add_batch_arguments, add_parallel_arguments, batch_files, is_batch
+from descompress import has_suffix, open_input, strip_compression
+from desparallel import map_files
+from desprofile import configure, timed
 
+RESIDUE_PATTERN = re.compile(r'"([^":\s]*):([A-Z]{3}_)(\d+)"')
+
+@timed('list_files')
 def list_eaf_files():
-    return [f for f in os.listdir() if f.endswith('.eaf')]
+    return [f for f in os.listdir() if has_suffix(f, '.eaf')]
+
+def parse_chain_numbering(specs):
+    """
+    Turn 'A=1' style specs into {chain: start}. A signed value ('B=+10',
+    'C=-3') shifts the existing numbers of that chain instead.
+    """
+    numbering = {}
+    for spec in specs:
+        chain, _, value = spec.partition('=')
+        if not value:
+            raise ValueError(f"Invalid chain numbering '{spec}', expected CHAIN=START or CHAIN=+OFFSET")
+        numbering[chain] = (value[0] in '+-', int(value))
+    return numbering
 
-def read_eaf_file(filename):
-    with open(filename, 'r') as file:
-        return file.readlines()
+def renumber_line(line, numbering):
+    """
+    Renumber every residue of the chains in numbering in a single pass over the
+    line. numbering maps a chain to (is_offset, value).
+    """
+    counters = {chain: value for chain, (is_offset, value) in numbering.items() if not is_offset}
 
-def write_eaf_file(filename, lines):
-    with open(filename, 'w') as file:
-        file.writelines(lines)
+    def replace(match):
+        chain, name, number = match.groups()
+        if chain not in numbering:
+            return match.group(0)
+        is_offset, value = numbering[chain]
+        if is_offset:
+            new_number = int(number) + value
+        else:
+            new_number = counters[chain]
+            counters[chain] += 1
+        return f'"{chain}:{name}{new_number}"'
 
-def update_protein_residues(lines, start_number):
-    pattern = re.compile(r'("A:[A-Z]{3}_)(\d+)(")')
+    return RESIDUE_PATTERN.sub(replace, line)
+
+def update_protein_residues(lines, start_number, numbering=None):
+    if numbering is None:
+        numbering = {'A': (False, start_number)}
     for i, line in enumerate(lines):
         if "ProteinResidues" in line:
-            new_residues = []
-            matches = pattern.findall(line)
-            if matches:
-                new_start = start_number
-                new_line = line
-                for match in matches:
-                    original = f'{match[0]}{match[1]}{match[2]}'
-                    replacement = f'{match[0]}{new_start}{match[2]}'
-                    new_line = new_line.replace(original, replacement, 1)
-                    new_start += 1
-                lines[i] = new_line
+            lines[i] = renumber_line(line, numbering)
     return lines
 
-def main():
+@timed('rewrite')
+def rewrite_eaf_file(filename, new_filename, numbering):
+    """
+    Stream filename into new_filename line by line, renumbering the
+    ProteinResidues lines. The output is written to a temporary file first.
+    """
+    output_dir = os.path.dirname(os.path.abspath(new_filename))
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    try:
+        with open_input(filename, 'r') as source, os.fdopen(fd, 'w') as target:
+            for line in source:
+                if "ProteinResidues" in line:
+                    line = renumber_line(line, numbering)
+                target.write(line)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)  # mkstemp creates the file as private
+        os.replace(temp_path, new_filename)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return new_filename
+
+def renumber_file(filename, numbering):
+    return rewrite_eaf_file(filename, updated_filename(filename), numbering)
+
+def renumber_files(filenames, numbering, workers=None, chunksize=1):
+    """
+    Renumber many files in parallel. Returns the new file names, None for the
+    files that failed.
+    """
+    return map_files(functools.partial(renumber_file, numbering=numbering), filenames, workers, chunksize)
+
+def updated_filename(filename):
+    return strip_compression(filename).replace('.eaf', '_updt.eaf')
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Renumber the ProteinResidues of Desmond .eaf files. Without batch options, the file is chosen interactively.")
+    group = add_batch_arguments(parser, names=False, kind='eaf')
+    group.add_argument('--directory', metavar='DIR',
+                       help="Renumber every .eaf file of this directory (enables batch mode).")
+    group.add_argument('--start', type=int, metavar='NUMBER',
+                       help="Starting number for the sequence of chain A.")
+    group.add_argument('--chain', nargs='+', default=[], metavar='CHAIN=START',
+                       help="Numbering per chain: CHAIN=START restarts the sequence at START, CHAIN=+N or CHAIN=-N shifts the existing numbers.")
+    add_parallel_arguments(group)
+    args = parser.parse_args(argv)
+    if (is_batch(args) or args.directory) and args.start is None and not args.chain:
+        parser.error("--start or --chain is required in batch mode")
+    try:
+        args.numbering = parse_chain_numbering(args.chain)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.start is not None:
+        args.numbering.setdefault('A', (False, args.start))
+    return args
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    if is_batch(args) or args.directory:
+        filenames = batch_files(args)
+        if args.directory:
+            filenames += sorted(os.path.join(args.directory, f) for f in os.listdir(args.directory)
+                                if has_suffix(f, '.eaf') and not has_suffix(f, '_updt.eaf'))
+        for filename, new_filename in zip(filenames, renumber_files(filenames, args.numbering, args.workers, args.chunksize)):
+            if new_filename is not None:
+                print(f"Updated file saved as {new_filename}.")
+            else:
+                print(f"Failed to renumber {filename}. Skipping...")
+        return
+
     eaf_files = list_eaf_files()
     if not eaf_files:
         print("No .eaf files found in the current directory.")
@@ -45,21 +143,18 @@ def main():
         return
 
     selected_file = eaf_files[file_choice]
-    lines = read_eaf_file(selected_file)
-    
+
     print("Current ProteinResidues lines:")
-    for line in lines:
-        if "ProteinResidues" in line:
-            print(line.strip())
+    with open_input(selected_file, 'r') as file:
+        for line in file:
+            if "ProteinResidues" in line:
+                print(line.strip())
 
     start_number = int(input("Enter the starting number for the sequence: "))
 
-    updated_lines = update_protein_residues(lines, start_number)
-    new_filename = selected_file.replace('.eaf', '_updt.eaf')
-    write_eaf_file(new_filename, updated_lines)
+    new_filename = rewrite_eaf_file(selected_file, updated_filename(selected_file), {'A': (False, start_number)})
 
     print(f"Updated file saved as {new_filename} with new sequence starting from {start_number}.")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,207 @@
+import math
+
+import numpy as np
+
+COMPRESSION = 500
+
+
+def _compress(means, weights, compression):
+    """
+    Merge sorted centroids of a t-digest so that each one covers at most one
+    unit of the arcsine scale function, which keeps the tails fine-grained.
+    """
+    order = np.argsort(means, kind='stable')
+    means = means[order]
+    weights = weights[order]
+    total = weights.sum()
+    q_left = (np.cumsum(weights) - weights) / total
+    scale = compression / (2 * np.pi) * np.arcsin(2 * q_left - 1)
+    group = np.floor(scale - scale[0]).astype(np.int64)
+    merged_weights = np.bincount(group, weights=weights)
+    merged_means = np.bincount(group, weights=weights * means)
+    keep = merged_weights > 0
+    return merged_means[keep] / merged_weights[keep], merged_weights[keep]
+
+
+class StreamingStats:
+    """
+    Constant-memory summary of a series fed chunk by chunk: exact count, mean,
+    standard deviation, min and max (Welford/Chan updates) and approximate
+    quantiles from a t-digest. Accumulators of different replicas or workers
+    can be merged into one ensemble summary.
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.centroids = np.empty(0)
+        self.weights = np.empty(0)
+
+    def _combine(self, count, mean, m2, minimum, maximum, centroids, weights):
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+        self.centroids, self.weights = _compress(np.concatenate([self.centroids, centroids]),
+                                                 np.concatenate([self.weights, weights]), self.compression)
+
+    def update(self, values):
+        """
+        Add a chunk of values, e.g. a Result array or a slice of one.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not values.size:
+            return self
+        mean = values.mean()
+        self._combine(values.size, mean, float(np.sum((values - mean) ** 2)), values.min(), values.max(),
+                      values, np.ones(values.size))
+        return self
+
+    def merge(self, other):
+        """
+        Fold another accumulator into this one.
+        """
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.minimum, other.maximum,
+                          other.centroids, other.weights)
+        return self
+
+    def variance(self, ddof=0):
+        return self.m2 / (self.count - ddof) if self.count > ddof else np.nan
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance()))
+
+    def quantile(self, q):
+        """
+        Estimate the quantile(s) q (between 0 and 1) from the t-digest.
+        """
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [self.count]])
+        values = np.concatenate([[self.minimum], self.centroids, [self.maximum]])
+        return np.interp(np.asarray(q) * self.count, positions, values)
+
+    def metrics(self):
+        """
+        Same keys as calculate_metrics, or None if nothing was added.
+        """
+        if not self.count:
+            return None
+        q1, median, q3 = self.quantile([0.25, 0.5, 0.75])
+        return {
+            "Average": self.mean,
+            "Median": median,
+            "Standard Deviation": self.std,
+            "Interquartile Range": q3 - q1,
+            "First Quartile (Q1)": q1,
+            "Third Quartile (Q3)": q3,
+            "Minimum Value": self.minimum,
+            "Maximum Value": self.maximum
+        }
+
+
+def summarize_chunks(chunks, compression=COMPRESSION):
+    """
+    Build a StreamingStats from an iterable of arrays.
+    """
+    stats = StreamingStats(compression)
+    for chunk in chunks:
+        stats.update(chunk)
+    return stats
+
+
+def merge_stats(accumulators):
+    """
+    Merge per-replica accumulators into one ensemble summary.
+    """
+    ensemble = StreamingStats()
+    for stats in accumulators:
+        ensemble.merge(stats)
+    return ensemble
+
+
+def _beta_fraction(a, b, x, iterations=300, tolerance=1e-15):
+    """
+    Continued fraction of the incomplete beta function (modified Lentz),
+    evaluated for whole arrays at once until every element has converged.
+    """
+    tiny = 1e-300
+    c = np.ones_like(x)
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d.copy()
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1 + numerator / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            h *= d * c
+        if np.all(np.abs(d * c - 1) < tolerance):
+            break
+    return h
+
+
+def regularized_beta(a, b, x):
+    """
+    Regularized incomplete beta function I_x(a, b) of arrays, as
+    scipy.special.betainc, so that t-test p-values need only NumPy.
+    """
+    a, b, x = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (a, b, x)))
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    inside = (x > 0) & (x < 1)
+    mirror = x >= (a + 1) / (a + b + 2)  # Where the fraction converges fast for I_(1-x)(b, a) = 1 - I_x(a, b)
+    a, b, x = np.where(mirror, b, a), np.where(mirror, a, b), np.where(mirror, 1 - x, x)
+    a, b, x = a[inside], b[inside], x[inside]
+    result = np.where(mirror, 1.0, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        front = np.exp(a * np.log(x) + b * np.log1p(-x) + lgamma(a + b) - lgamma(a) - lgamma(b))
+        value = front * _beta_fraction(a, b, x) / a
+    result[inside] = np.where(mirror[inside], 1 - value, value)
+    return result
+
+
+def welch_test(mean_a, variance_a, count_a, mean_b, variance_b, count_b):
+    """
+    Welch's unequal-variance t-test of mean_b - mean_a for arrays of group
+    summaries (sample variances with ddof=1). Returns the difference, t, the
+    Welch-Satterthwaite degrees of freedom and the two-sided p-value; NaN
+    where a group has fewer than two values or both variances are zero.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error_a, error_b = variance_a / count_a, variance_b / count_b
+        difference = mean_b - mean_a
+        t = difference / np.sqrt(error_a + error_b)
+        df = (error_a + error_b) ** 2 / (error_a ** 2 / (count_a - 1) + error_b ** 2 / (count_b - 1))
+    valid = (count_a > 1) & (count_b > 1) & np.isfinite(t) & np.isfinite(df)
+    t, df = np.where(valid, t, np.nan), np.where(valid, df, np.nan)
+    p = np.full(np.shape(t), np.nan)
+    p[valid] = regularized_beta(df[valid] / 2, 0.5, df[valid] / (df[valid] + t[valid] ** 2))
+    return difference, t, df, p
+
+
+def benjamini_hochberg(p_values, axis=-1):
+    """
+    Benjamini-Hochberg adjusted p-values (q-values) along axis, each row of a
+    matrix being one family of tests. NaN p-values are left out of the family.
+    """
+    p = np.moveaxis(np.asarray(p_values, dtype=np.float64), axis, -1)
+    order = np.argsort(p, axis=-1)  # NaN sort last
+    ranked = np.take_along_axis(p, order, axis=-1)
+    tests = np.sum(~np.isnan(p), axis=-1, keepdims=True)
+    scaled = ranked * tests / np.arange(1, p.shape[-1] + 1)
+    scaled = np.minimum.accumulate(np.where(np.isnan(scaled), np.inf, scaled)[..., ::-1], axis=-1)[..., ::-1]
+    q = np.empty_like(p)
+    np.put_along_axis(q, order, np.where(np.isnan(ranked), np.nan, np.minimum(scaled, 1)), axis=-1)
+    return np.moveaxis(q, -1, axis)
@@ -0,0 +1,223 @@
+import argparse
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+from desbatch import default_name, expand_files
+from descompress import open_input
+
+TIME_COLUMN = 'Time (ns)'
+INDEX_FILE = 'index.json'
+
+
+def _new_matrix(path, rows, frames):
+    matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, frames))
+    matrix[:] = np.nan
+    return matrix
+
+
+def _grow_rows(path, rows):
+    """
+    Extend the (trajectories, frames) matrix in path to rows rows of NaN in
+    place. The .npy header keeps room for a longer first dimension, so only
+    the header and the new rows are written. Returns False, changing nothing,
+    if the header would not fit.
+    """
+    matrix = np.load(path, mmap_mode='r')
+    old_rows, frames, offset = matrix.shape[0], matrix.shape[1], matrix.offset
+    del matrix
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                                  'fortran_order': False, 'shape': (rows, frames)})
+    if len(header.getvalue()) != offset:
+        return False
+    with open(path, 'r+b') as file:
+        file.truncate(offset + rows * frames * np.dtype(np.float32).itemsize)
+        file.write(header.getvalue())
+    matrix = np.load(path, mmap_mode='r+')
+    matrix[old_rows:] = np.nan
+    matrix.flush()
+    return True
+
+
+def _copy_matrix(path, rows, frames, columns, block_rows=256):
+    """
+    Rewrite the matrix in path as a (rows, frames) one, its old frames going
+    to the given columns, a block of rows at a time.
+    """
+    old = np.load(path, mmap_mode='r')
+    matrix = _new_matrix(f'{path}.tmp', rows, frames)
+    for start in range(0, len(old), block_rows):
+        block = old[start:start + block_rows]
+        matrix[start:start + len(block), columns] = block
+    matrix.flush()
+    del matrix, old
+    os.replace(f'{path}.tmp', path)
+
+
+def _read_index(store_dir, time_column):
+    """
+    Return the index of the store in store_dir, or None when there is no
+    store there yet or it was built on another time column.
+    """
+    if not os.path.exists(os.path.join(store_dir, INDEX_FILE)):
+        return None
+    index = read_index(store_dir)
+    return index if index.get('time_column') == time_column else None
+
+
+def ingest_csv_files(csv_files, store_dir, names=None, time_column=TIME_COLUMN):
+    """
+    Add per-frame CSV files (Radius of Gyration and any other numeric column)
+    to a columnar store: one shared time index (time.npy) and, per quantity,
+    a float32 matrix with one row per trajectory (NaN where a trajectory has no
+    frame), plus an index.json describing them. The matrices are written as
+    .npy files so queries can memory-map them.
+    New trajectories are appended to the store already in store_dir, and a
+    trajectory ingested again under the same name replaces its row. The
+    matrices are only rewritten when the files bring frame times the store
+    does not have yet. Files are read one at a time.
+    """
+    import pandas as pd
+    csv_files = list(csv_files)
+    names = list(names) if names is not None else [default_name(file) for file in csv_files]
+    os.makedirs(store_dir, exist_ok=True)
+    index = _read_index(store_dir, time_column)
+    if index is None:
+        for file_name in os.listdir(store_dir):  # A store built on another time column
+            if file_name == INDEX_FILE or re.fullmatch(r'q\d+\.npy', file_name):
+                os.remove(os.path.join(store_dir, file_name))
+        index = {'time_column': time_column, 'trajectories': [], 'sources': [], 'quantities': {}}
+        old_time = np.empty(0)
+    else:
+        old_time = np.load(os.path.join(store_dir, 'time.npy'))
+
+    times = [old_time]
+    for file in csv_files:  # Only the time columns, to size the store before writing any row
+        with open_input(file) as stream:
+            times.append(pd.read_csv(stream, usecols=[time_column])[time_column].to_numpy(dtype=np.float64))
+    time = np.unique(np.concatenate(times))
+
+    rows = {name: row for row, name in enumerate(index['trajectories'])}
+    for name, file in zip(names, csv_files):
+        if name not in rows:
+            rows[name] = len(rows)
+            index['trajectories'].append(name)
+            index['sources'].append(None)
+        index['sources'][rows[name]] = os.path.abspath(file)
+    for file_name in index['quantities'].values():
+        path = os.path.join(store_dir, file_name)
+        if len(time) != len(old_time) or not _grow_rows(path, len(rows)):
+            _copy_matrix(path, len(rows), len(time), np.searchsorted(time, old_time))
+    np.save(os.path.join(store_dir, 'time.npy'), time)
+
+    for name, file in zip(names, csv_files):
+        with open_input(file) as stream:
+            data = pd.read_csv(stream)
+        numeric = data.select_dtypes(exclude=['object'])
+        columns = np.searchsorted(time, data[time_column].to_numpy(dtype=np.float64))
+        for quantity in numeric.columns:
+            if quantity != time_column and quantity not in index['quantities']:
+                index['quantities'][quantity] = f'q{len(index["quantities"])}.npy'
+                _new_matrix(os.path.join(store_dir, index['quantities'][quantity]), len(rows), len(time)).flush()
+        for quantity, file_name in index['quantities'].items():
+            matrix = np.load(os.path.join(store_dir, file_name), mmap_mode='r+')
+            matrix[rows[name]] = np.nan  # The trajectory may be ingested again
+            if quantity in numeric.columns:
+                matrix[rows[name], columns] = numeric[quantity].to_numpy(dtype=np.float32)
+            matrix.flush()
+            del matrix
+    with open(os.path.join(store_dir, INDEX_FILE), 'w') as file:
+        json.dump(index, file, indent=1)
+    return index
+
+
+def read_index(store_dir):
+    with open(os.path.join(store_dir, INDEX_FILE)) as file:
+        return json.load(file)
+
+
+def find_quantity(index, quantity):
+    """
+    Return the stored column name matching quantity exactly or, failing that,
+    the first one containing it (e.g. 'Radius of Gyration').
+    """
+    if quantity in index['quantities']:
+        return quantity
+    for column in index['quantities']:
+        if quantity in column:
+            return column
+    raise KeyError(f"No column matching '{quantity}' in the store")
+
+
+def query(store_dir, quantity='Radius of Gyration', trajectories=None, t_start=None, t_end=None):
+    """
+    Return (time, values, names) for a set of trajectories (all by default) in
+    the time window [t_start, t_end]. values is a (trajectories, frames)
+    float32 array read from the memory-mapped store, so only the requested
+    rows and columns are loaded.
+    """
+    index = read_index(store_dir)
+    column = find_quantity(index, quantity)
+    time = np.load(os.path.join(store_dir, 'time.npy'), mmap_mode='r')
+    start = 0 if t_start is None else int(np.searchsorted(time, t_start, side='left'))
+    end = len(time) if t_end is None else int(np.searchsorted(time, t_end, side='right'))
+
+    names = index['trajectories']
+    if trajectories is None:
+        rows = np.arange(len(names))
+    else:
+        positions = {name: row for row, name in enumerate(names)}
+        missing = [name for name in trajectories if name not in positions]
+        if missing:
+            raise KeyError(f"Trajectories not in the store: {', '.join(missing)}")
+        rows = np.array([positions[name] for name in trajectories], dtype=np.int64)
+
+    matrix = np.load(os.path.join(store_dir, index['quantities'][column]), mmap_mode='r')
+    values = np.asarray(matrix[rows, start:end])
+    return np.array(time[start:end]), values, [names[row] for row in rows]
+
+
+def convert_units(values, unit_conversion):
+    return np.asarray(values) / unit_conversion
+
+
+def resample(time, values, step):
+    """
+    Average the frames of every trajectory over consecutive windows of step
+    time units, ignoring missing frames.
+    """
+    time = np.asarray(time)
+    values = np.atleast_2d(values)
+    if not len(time) or step <= 0:
+        return time, values
+    bins = np.floor((time - time[0]) / step).astype(np.int64)
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    lengths = np.diff(np.append(starts, len(time)))
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0), starts, axis=1)
+    counts = np.add.reduceat(present, starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return np.add.reduceat(time, starts) / lengths, means.astype(values.dtype, copy=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add per-frame CSV files (e.g. Radius of Gyration) to a columnar store.")
+    parser.add_argument('store', help="Directory of the store (created if needed).")
+    parser.add_argument('files', nargs='+', help="CSV files or glob patterns.")
+    parser.add_argument('--names', nargs='+', metavar='NAME', help="Trajectory names (default: the file names).")
+    args = parser.parse_args(argv)
+
+    csv_files = expand_files(args.files)
+    if args.names and len(args.names) != len(csv_files):
+        parser.error(f"{len(args.names)} names given for {len(csv_files)} files")
+    index = ingest_csv_files(csv_files, args.store, args.names)
+    print(f"Stored {len(index['trajectories'])} trajectories and {len(index['quantities'])} quantities in {args.store}")
+
+
+if __name__ == "__main__":
+    main()
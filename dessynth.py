@@ -0,0 +1,157 @@
+import argparse
+import os
+
+import numpy as np
+
+BYTES_PER_VALUE = 7  # '%.4f ' of values below 10
+CHUNK_VALUES = 100000  # Values generated and formatted at a time, so memory does not grow with the file size
+RESIDUE_NAMES = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+                 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+BACKBONE_ASL = '(((protein) and backbone) and not (atom.ele H) )'
+LIGAND_ASL = 'at.n 4001,4002,4003,4004,4005,4006'
+
+
+def _rmsd_chunks(frames, plateau, rng, chunk_frames=CHUNK_VALUES):
+    kernel = 0.95 ** np.arange(60)
+    kernel /= np.sqrt(np.sum(kernel ** 2))
+    tail = rng.normal(0, 0.05 * plateau, len(kernel) - 1)  # Inputs the next chunk's first frames still depend on
+    for start in range(0, frames, chunk_frames):
+        size = min(chunk_frames, frames - start)
+        inputs = np.concatenate([tail, rng.normal(0, 0.05 * plateau, size)])
+        noise = np.convolve(inputs, kernel, 'valid')
+        tail = inputs[size:]
+        rise = 1 - np.exp(-np.arange(start, start + size) / max(frames / 50, 1))
+        yield np.abs(plateau * rise + noise)
+
+
+def rmsd_series(frames, plateau, rng):
+    """
+    RMSD-like series: a quick rise from zero to a plateau plus exponentially
+    correlated noise, like consecutive MD frames.
+    """
+    return np.concatenate(list(_rmsd_chunks(frames, plateau, rng)))
+
+
+def _normal_chunks(frames, mean, sd, rng, chunk_frames=CHUNK_VALUES):
+    for start in range(0, frames, chunk_frames):
+        yield rng.normal(mean, sd, min(chunk_frames, frames - start))
+
+
+def _write_values(file, chunks):
+    for block in chunks:
+        file.write(('%.4f ' * len(block)) % tuple(block))
+
+
+def _write_block(file, name, fields, chunks):
+    file.write(f'  {{{name} = {{\n')
+    for key, value in fields:
+        file.write(f'      {key} = {value}\n')
+    file.write('      Result = [')
+    _write_values(file, chunks)
+    file.write(']\n    }\n  }\n')
+
+
+def frames_for_size(size_mb, noise_blocks=0):
+    """
+    Number of frames giving an .eaf of roughly size_mb megabytes.
+    """
+    return max(10, int(size_mb * 1e6 / (BYTES_PER_VALUE * (3 + noise_blocks))))
+
+
+def write_eaf(file_path, frames, residues=300, noise_blocks=0, seed=0):
+    """
+    Write a synthetic Desmond .eaf with backbone RMSD, ligand RMSD fit by
+    protein and by ligand, backbone RMSF with its ProteinResidues, and
+    noise_blocks unrelated blocks (nested ProtLigInter-like data and extra
+    per-frame series) interleaved with them. The series are generated and
+    written a chunk at a time.
+    """
+    rng = np.random.default_rng(seed)
+    residue_labels = ' '.join(f'"A:{RESIDUE_NAMES[i % len(RESIDUE_NAMES)]}_{i + 1}"' for i in range(residues))
+    rmsf = np.abs(rng.gamma(2, 0.4, residues) + 0.3)
+    blocks = [
+        ('RMSD', [('ASL', f'"{BACKBONE_ASL}"'), ('Frame', 0), ('Panel', 'pl_interact_survey'),
+                  ('SelectionType', 'Backbone'), ('Type', 'ASL'), ('Unit', 'Angstrom')], _rmsd_chunks(frames, 2.0, rng)),
+        ('RMSD', [('ASL', f'"{LIGAND_ASL}"'), ('FitBy', '"(protein)"'), ('Frame', 0),
+                  ('SelectionType', 'Ligand'), ('Type', 'ASL'), ('Unit', 'Angstrom')], _rmsd_chunks(frames, 3.5, rng)),
+        ('RMSD', [('ASL', f'"{LIGAND_ASL}"'), ('FitBy', f'"{LIGAND_ASL}"'), ('Frame', 0),
+                  ('SelectionType', 'Ligand'), ('Type', 'ASL'), ('Unit', 'Angstrom')], _rmsd_chunks(frames, 0.8, rng)),
+        ('RMSF', [('ASL', '"((protein) and a. CA)"'), ('FitBy', f'"{BACKBONE_ASL}"'), ('Frame', 0),
+                  ('ProteinResidues', f'[{residue_labels} ]'), ('SelectionType', 'C-alpha'), ('Type', 'ASL'),
+                  ('Unit', 'Angstrom')], [rmsf]),
+    ]
+    with open(file_path, 'w') as file:
+        file.write('Keywords = [\n')
+        for number, (name, fields, result) in enumerate(blocks):
+            _write_block(file, name, fields, result)
+            if number < noise_blocks:
+                file.write('  {ProtLigInter = {\n      HBondResult = [\n')
+                for frame in range(0, frames, max(frames // 50, 1)):
+                    residue = rng.integers(1, residues + 1)
+                    file.write(f'        [{{Frame = {frame} ProtResidue = "A:ALA_{residue}"}} ]\n')
+                file.write('      ]\n    }\n  }\n')
+                _write_block(file, 'Rg', [('ASL', f'"{LIGAND_ASL}"'), ('Frame', 0)], _normal_chunks(frames, 5, 0.2, rng))
+        for _ in range(noise_blocks - len(blocks)):
+            _write_block(file, 'Rg', [('ASL', f'"{LIGAND_ASL}"'), ('Frame', 0)], _normal_chunks(frames, 5, 0.2, rng))
+        file.write(']\n')
+    return file_path
+
+
+def write_rg_csv(file_path, frames, time_step=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    walk = 0.0
+    with open(file_path, 'w') as file:
+        file.write('Time (ns),Radius of Gyration (A)\n')
+        for start in range(0, frames, CHUNK_VALUES):
+            steps = np.cumsum(rng.normal(0, 0.01, min(CHUNK_VALUES, frames - start))) + walk
+            walk = steps[-1]
+            rows = np.column_stack([np.arange(start, start + len(steps)) * time_step, 15 + steps * 0.1])
+            file.write(('%.3f,%.4f\n' * len(rows)) % tuple(rows.ravel()))
+    return file_path
+
+
+def write_mmgbsa_csv(file_path, rows, columns=40, compounds=1, seed=0):
+    """
+    Prime MM-GBSA like export: a title column, numeric r_psp_* energy columns
+    (some always zero) and a string column, written a chunk of rows at a time.
+    """
+    rng = np.random.default_rng(seed)
+    names = ['r_psp_MMGBSA_dG_Bind'] + [f'r_psp_MMGBSA_term{i}' for i in range(1, columns)]
+    compound_names = np.array([f'compound_{i}' for i in range(compounds)], dtype=object)
+    chunk_rows = max(1, CHUNK_VALUES // columns)
+    with open(file_path, 'w') as file:
+        file.write(','.join(['title'] + names + ['s_m_entry_name']) + '\n')
+        row_format = '%s,' + ','.join(['%.3f'] * columns) + ',%s\n'
+        for start in range(0, rows, chunk_rows):
+            size = min(chunk_rows, rows - start)
+            values = rng.normal(-40, 8, (size, columns))
+            values[:, columns // 2:columns // 2 + 3] = 0
+            titles = compound_names[rng.integers(0, compounds, size)]
+            table = np.empty((size, columns + 2), dtype=object)
+            table[:, 0], table[:, 1:-1], table[:, -1] = titles, values, titles + '.1'
+            file.write((row_format * size) % tuple(table.ravel()))
+    return file_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic Desmond .eaf, Rg and MM-GBSA CSV files for benchmarking.")
+    parser.add_argument('directory', help="Output directory.")
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 10, 100], metavar='MB',
+                        help="Approximate sizes of the .eaf files, in MB (default: 1 10 100).")
+    parser.add_argument('--residues', type=int, default=300, help="Number of residues (default: 300).")
+    parser.add_argument('--noise-blocks', type=int, default=0, help="Unrelated blocks to add (default: 0).")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.directory, exist_ok=True)
+    for size in args.sizes:
+        frames = frames_for_size(size, args.noise_blocks)
+        stem = os.path.join(args.directory, f'synthetic_{size:g}MB')
+        write_eaf(f'{stem}.eaf', frames, args.residues, args.noise_blocks, args.seed)
+        write_rg_csv(f'{stem}_rg.csv', frames, seed=args.seed)
+        write_mmgbsa_csv(f'{stem}_mmgbsa.csv', max(10, frames // 20), seed=args.seed)
+        print(f"Wrote {stem}.eaf ({frames} frames) and its CSV files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import csv
+import io
+import os
+import time
+
+import numpy as np
+
+from desbatch import (HOLO_OPTIONS, STRUCTURE_TYPES, add_batch_arguments, add_downsample_argument, add_figure_arguments,
+                      batch_entries, finish_figure, is_batch, make_parent_dir, use_headless_backend)
+from desdownsample import plot_line
+from desprofile import configure, timed
+from desstats import StreamingStats
+from desstore import TIME_COLUMN
+
+INTERVAL = 10.0
+HOLO_SELECTIONS = {'protein': 'ligand_protein', 'ligand': 'ligand_ligand', 'backbone': 'backbone'}
+
+
+class _Tail:
+    """
+    A growing series: its x and y values seen so far, kept as appended chunks,
+    and a StreamingStats of the y values.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.x_chunks = []
+        self.y_chunks = []
+        self.frames = 0
+        self.stats = StreamingStats()
+
+    def _append(self, x, y):
+        self.x_chunks.append(x)
+        self.y_chunks.append(y)
+        self.frames += len(y)
+        self.stats.update(y)
+
+    def series(self):
+        if len(self.x_chunks) > 1:  # Merge the chunks once, later calls reuse the result
+            self.x_chunks = [np.concatenate(self.x_chunks)]
+            self.y_chunks = [np.concatenate(self.y_chunks)]
+        if not self.x_chunks:
+            return np.empty(0), np.empty(0)
+        return self.x_chunks[0], self.y_chunks[0]
+
+
+class CsvTail(_Tail):
+    """
+    Follow a per-frame CSV file (e.g. Radius of Gyration) that is being
+    appended to. Each poll reads only the bytes added since the previous one,
+    up to the last complete line. A file that shrinks is read again from the
+    start.
+    """
+
+    def __init__(self, path, column='Radius of Gyration', time_column=TIME_COLUMN, unit_conversion=1):
+        self.column = column
+        self.time_column = time_column
+        self.unit_conversion = unit_conversion
+        super().__init__(path)
+
+    def reset(self):
+        super().reset()
+        self.offset = 0
+        self.usecols = None
+
+    def _parse_rows(self, data):
+        """
+        Parse complete lines into a (rows, 2) array of the time and value
+        columns. Malformed rows are skipped and reported instead of stopping
+        the tail.
+        """
+        if not data.strip():
+            return np.empty((0, 2))
+        try:
+            return np.loadtxt(io.BytesIO(data), delimiter=',', usecols=self.usecols, ndmin=2)
+        except ValueError:
+            pass
+        rows, skipped = [], 0
+        for line in data.splitlines():
+            fields = line.split(b',')
+            try:
+                rows.append([float(fields[i]) for i in self.usecols])
+            except (ValueError, IndexError):
+                skipped += bool(line.strip())
+        if skipped:
+            print(f"Skipped {skipped} malformed rows of {self.path}")
+        return np.array(rows).reshape(-1, 2)
+
+    def poll(self):
+        """
+        Parse the rows appended since the last poll and return their number.
+        """
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return 0
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read(size - self.offset)
+        end = data.rfind(b'\n') + 1  # A partly written last line waits for the next poll
+        if not end:
+            return 0
+        data = data[:end]
+        if self.usecols is None:
+            header, _, data = data.partition(b'\n')
+            columns = next(csv.reader([header.decode()]))
+            matches = [i for i, name in enumerate(columns) if self.column in name]
+            if self.time_column not in columns or not matches:
+                raise ValueError(f"{self.path} has no '{self.time_column}' or '{self.column}' column")
+            self.usecols = (columns.index(self.time_column), matches[0])
+            self.offset += len(header) + 1  # The header is never parsed again, whatever happens to the rows
+            end -= len(header) + 1
+        rows = self._parse_rows(data)
+        self.offset += end
+        if not len(rows):
+            return 0
+        self._append(rows[:, 0], rows[:, 1] / self.unit_conversion)
+        return len(rows)
+
+
+class EafTail(_Tail):
+    """
+    Follow the RMSD series of an .eaf file. Desmond rewrites the whole file
+    rather than appending to it, so a change of size or modification time
+    triggers a fresh parse of the RMSD blocks, but only the frames beyond
+    those already seen are added to the statistics. A file caught half
+    written is retried at the next poll.
+    """
+
+    def __init__(self, path, selection='backbone'):
+        self.selection = selection
+        super().__init__(path)
+
+    def reset(self):
+        super().reset()
+        self.signature = None
+
+    def poll(self):
+        from deseaf import EafSyntaxError, load_block, result_values, rmsd_block
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return 0
+        try:
+            values = result_values(load_block(self.path, lambda catalog: rmsd_block(catalog, self.selection),
+                                              use_cache=False))
+        except EafSyntaxError:
+            return 0
+        self.signature = signature
+        if values is None:
+            return 0
+        if len(values) < self.frames:
+            self.reset()
+            self.signature = signature
+        new_values = values[self.frames:]
+        self._append(np.arange(self.frames, self.frames + len(new_values)), new_values)
+        return len(new_values)
+
+
+def write_summary(file_path, tails, names):
+    """
+    Rewrite the CSV summary of the watched series in one atomic replace, so a
+    reader never sees a partial file.
+    """
+    make_parent_dir(file_path)
+    temp_path = f'{file_path}.tmp'
+    with open(temp_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'file', 'frames', 'last_x', 'last_value', 'mean', 'sd', 'median', 'min', 'max'])
+        for tail, name in zip(tails, names):
+            x, y = tail.series()
+            if not tail.frames:
+                writer.writerow([name, tail.path, 0] + [''] * 7)
+                continue
+            writer.writerow([name, tail.path, tail.frames, x[-1], y[-1], tail.stats.mean, tail.stats.std,
+                             tail.stats.quantile(0.5), tail.stats.minimum, tail.stats.maximum])
+    os.replace(temp_path, file_path)
+
+
+@timed('render')
+def plot_tails(tails, names, x_label, y_label, title, output, formats=("png",), downsample='minmax'):
+    import matplotlib.pyplot as plt
+    colors = plt.get_cmap('tab10', len(tails))
+    for i, (tail, name) in enumerate(zip(tails, names)):
+        x, y = tail.series()
+        if tail.frames:
+            plot_line(plt.gca(), x, y, downsample, label=name, color=colors(i))
+    plt.xlabel(x_label)
+    plt.ylabel(y_label)
+    plt.title(title)
+    plt.legend()
+    finish_figure(output, formats)
+
+
+def watch(tails, names, interval=INTERVAL, on_update=None, iterations=None):
+    """
+    Poll every tail each interval seconds and call on_update(tails, names)
+    whenever new frames arrived. Polling costs a stat() per file when nothing
+    changed. Runs until interrupted, or for iterations polls.
+    """
+    polls = 0
+    while True:
+        new_frames = 0
+        for tail in tails:
+            try:
+                new_frames += tail.poll()
+            except (OSError, ValueError) as e:
+                print(f"Error processing {tail.path}: {e}")
+        if new_frames and on_update is not None:
+            on_update(tails, names)
+        polls += 1
+        if iterations is not None and polls >= iterations:
+            return
+        time.sleep(interval)
+
+
+def run(tails, names, interval=INTERVAL, output=None, formats=("png",), summary_path=None, iterations=None,
+        x_label='Frame', y_label='RMSD (Angstrom)', title='RMSD over Time', downsample='minmax'):
+    """
+    Watch the tails, refreshing the figure at output and the CSV summary at
+    summary_path after every poll that brought new frames.
+    """
+    use_headless_backend()
+
+    def update(tails, names):
+        status = ', '.join(f"{name}: {tail.frames} frames, mean {tail.stats.mean:.4g}"
+                           for tail, name in zip(tails, names) if tail.frames)
+        print(f"[{time.strftime('%H:%M:%S')}] {status}")
+        if summary_path:
+            write_summary(summary_path, tails, names)
+        if output:
+            plot_tails(tails, names, x_label, y_label, title, output, formats, downsample)
+
+    try:
+        watch(tails, names, interval, update, iterations)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Follow growing Rg CSV or .eaf outputs of running jobs and refresh a figure and a summary as new frames arrive.")
+    parser.add_argument('kind', choices=['rg', 'rmsd'], help="Follow Rg CSV files or the RMSD of .eaf files.")
+    group = add_batch_arguments(parser)
+    group.add_argument('--interval', type=float, default=INTERVAL, metavar='SECONDS',
+                       help=f"Polling interval (default: {INTERVAL:g}).")
+    group.add_argument('--iterations', type=int, metavar='N', help="Stop after N polls (default: run until interrupted).")
+    group.add_argument('--summary', metavar='CSV', help="CSV summary rewritten after every update.")
+    group.add_argument('--unit', type=float, choices=[1, 10], default=1,
+                       help="For rg: 1 for Å, 10 for nm (default: 1).")
+    group.add_argument('--structure', choices=STRUCTURE_TYPES, default='apo',
+                       help="For rmsd: type of structure of every input (default: apo).")
+    group.add_argument('--holo', choices=HOLO_OPTIONS, default='protein',
+                       help="For rmsd of holo structures: ligand fit by protein, ligand fit by ligand or the protein's backbone (default: protein).")
+    add_downsample_argument(group)
+    add_figure_arguments(group, 'watch')
+    args = parser.parse_args(argv)
+    if not is_batch(args):
+        parser.error("--files, --manifest or --catalog is required")
+    args.catalog_kind = 'rg' if args.kind == 'rg' else 'eaf'
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure(args)
+    entries = batch_entries(args)
+    names = [name for _, name in entries]
+    if args.kind == 'rg':
+        tails = [CsvTail(file, unit_conversion=args.unit) for file, _ in entries]
+        run(tails, names, args.interval, args.output, args.formats, args.summary, args.iterations,
+            TIME_COLUMN, f'Radius of Gyration ({"Å" if args.unit == 1 else "nm"})', 'Radius of Gyration over Time',
+            args.downsample)
+    else:
+        selection = 'backbone' if args.structure == 'apo' else HOLO_SELECTIONS[args.holo]
+        run([EafTail(file, selection) for file, _ in entries], names, args.interval, args.output, args.formats,
+            args.summary, args.iterations, downsample=args.downsample)
+
+
+if __name__ == "__main__":
+    main()
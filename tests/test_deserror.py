@@ -0,0 +1,32 @@
+import numpy as np
+
+from deserror import error_analysis
+from dessynth import frames_for_size, rmsd_series
+
+
+def ar1(frames, phi, rng):
+    noise = rng.normal(size=frames)
+    series = np.empty(frames)
+    series[0] = noise[0]
+    for i in range(1, frames):
+        series[i] = phi * series[i - 1] + noise[i]
+    return series
+
+
+def test_stationary_ar1_errors_agree():
+    series = ar1(20000, 0.9, np.random.default_rng(1))
+    analysis = error_analysis(series)
+    expected_tau = (1 + 0.9) / (1 - 0.9)
+    assert abs(analysis['tau'][0] - expected_tau) / expected_tau < 0.3
+    se = analysis['se_tau'][0]
+    assert abs(analysis['se_block'][0] - se) / se < 0.3
+    assert abs(analysis['se_bootstrap'][0] - se) / se < 0.3
+    assert analysis['ci_low'][0] < series.mean() < analysis['ci_high'][0]
+
+
+def test_ramped_series_interval_contains_mean():
+    series = rmsd_series(frames_for_size(1), 2.0, np.random.default_rng(0))
+    analysis = error_analysis(series)
+    assert analysis['ci_low'][0] < series.mean() < analysis['ci_high'][0]
+    se = analysis['se_tau'][0]
+    assert abs(analysis['se_bootstrap'][0] - se) / se < 0.5